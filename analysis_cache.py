@@ -0,0 +1,342 @@
+#!/usr/local/bin/python3
+"""
+A persistent cache of Mystem analyses.
+
+Analyses are stored in an SQLite file keyed by a digest of an analyzed text together with a version
+of Mystem which produced them and of the cache format, so the cache is invalidated automatically
+when Mystem or its options change.
+The number of entries is capped; least recently used entries are evicted first.
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from typing import Callable, List, Union
+
+DEFAULT_MAX_ENTRIES = 500000
+
+# Analyses cached by earlier formats aren't used: some of them were made with texts joined into one line.
+CACHE_FORMAT = 2
+
+# A number of pending changes to accumulate before writing them to a disk.
+_FLUSH_EVERY = 1000
+
+
+def text_key(text: str) -> bytes:
+    """
+    Calculate a key of a text.
+
+    :param text: A text to analyze.
+
+    :return: A 128-bit digest of the text.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def mystem_version(analyzer) -> str:
+    """
+    Get a string identifying a Mystem binary and the options it's run with.
+
+    :param analyzer: A Mystem instance or a pool of them.
+
+    :return: A version string.
+    """
+    path = getattr(analyzer, "mystem_bin", getattr(analyzer, "_mystem_bin", None))
+    args = " ".join(getattr(analyzer, "mystem_args", getattr(analyzer, "_mystemargs", [])))
+    if not path or not os.path.isfile(path):
+        return "unknown " + args
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return "{} {}".format(digest.hexdigest(), args)
+
+
+def cache_version(analyzer) -> str:
+    """
+    Get a version analyses of a Mystem instance or a pool are cached under.
+    """
+    return "{} format {}".format(mystem_version(analyzer), CACHE_FORMAT)
+
+
+class AnalysisCache(object):
+    """
+    An SQLite-backed storage of Mystem analyses with LRU eviction.
+    """
+
+    def __init__(self, path: str, max_entries: Union[int, None] = None):
+        """
+        Open a cache (it's created if it doesn't exist).
+
+        :param path: A path to a cache file.
+        :param max_entries: A maximal number of entries to keep. If None, the value saved in the file is used.
+        """
+        self.path = path
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                key BLOB NOT NULL,
+                version TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (key, version)
+            );
+            CREATE INDEX IF NOT EXISTS analyses_used ON analyses (used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        if max_entries is not None:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('max_entries', ?)", (str(max_entries),))
+            self._conn.commit()
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'max_entries'").fetchone()
+        self.max_entries = int(row[0]) if row else DEFAULT_MAX_ENTRIES
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(used), 0) FROM analyses").fetchone()[0]
+        self._touched, self._added = {}, {}
+
+    def __len__(self):
+        with self._lock:
+            self._flush()
+            return self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, text: str, version: str) -> Union[list, None]:
+        """
+        Get a cached analysis.
+
+        :param text: An analyzed text.
+        :param version: A Mystem version.
+
+        :return: An analysis or None if the text is not in the cache.
+        """
+        key = text_key(text)
+        with self._lock:
+            if (key, version) in self._added:
+                self.hits += 1
+                return json.loads(self._added[(key, version)][0])
+            row = self._conn.execute(
+                "SELECT analysis FROM analyses WHERE key = ? AND version = ?", (key, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[(key, version)] = self._tick()
+            if len(self._touched) >= _FLUSH_EVERY:
+                self._flush()
+            return json.loads(row[0])
+
+    def put(self, text: str, version: str, analysis: list):
+        """
+        Save an analysis.
+
+        :param text: An analyzed text.
+        :param version: A Mystem version.
+        :param analysis: Mystem's output for the text.
+        """
+        with self._lock:
+            self._added[(text_key(text), version)] = (json.dumps(analysis, ensure_ascii=False), self._tick())
+            if len(self._added) >= _FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if not self._touched and not self._added:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE analyses SET used = ? WHERE key = ? AND version = ?",
+                ((used, key, version) for (key, version), used in self._touched.items())
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)",
+                ((key, version, analysis, used) for (key, version), (analysis, used) in self._added.items())
+            )
+            if self._added:
+                self._evict()
+        self._touched, self._added = {}, {}
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM analyses WHERE rowid IN (SELECT rowid FROM analyses ORDER BY used LIMIT ?)", (excess,)
+            )
+
+    def flush(self):
+        """
+        Write all pending changes to a disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def evict(self):
+        """
+        Write pending changes and remove least recently used entries exceeding the limit.
+        """
+        with self._lock:
+            self._flush()
+            with self._conn:
+                self._evict()
+
+    def clear(self, version: Union[str, None] = None):
+        """
+        Remove cached analyses.
+
+        :param version: If given, only analyses cached under other versions are removed (see cache_version).
+        """
+        with self._lock:
+            self._touched, self._added = {}, {}
+            with self._conn:
+                if version is None:
+                    self._conn.execute("DELETE FROM analyses")
+                else:
+                    self._conn.execute("DELETE FROM analyses WHERE version != ?", (version,))
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._flush()
+                self._conn.close()
+                self._conn = None
+
+
+# A cache currently used by all the caching analyzers of a process.
+_cache = None
+
+
+def configure(path: Union[str, None], max_entries: Union[int, None] = None):
+    """
+    Make all the caching analyzers of a process use a cache file.
+
+    :param path: A path to a cache file. If None, caching is turned off.
+    :param max_entries: A maximal number of entries to keep (see AnalysisCache).
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = AnalysisCache(path, max_entries) if path else None
+
+
+def current_cache() -> Union[AnalysisCache, None]:
+    return _cache
+
+
+@atexit.register
+def _close_cache():
+    if _cache is not None:
+        _cache.close()
+        logging.info("Analysis cache: %d hits, %d misses", _cache.hits, _cache.misses)
+
+
+class CachingAnalyzer(object):
+    """
+    A Mystem wrapper reading analyses through a cache configured for a process.
+    Without a cache configured, calls are passed to Mystem directly.
+    """
+
+    def __init__(self, analyzer):
+        """
+        :param analyzer: A Mystem instance or a pool of them (see mystem_pool.py).
+        """
+        self.analyzer = analyzer
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = cache_version(self.analyzer)
+        return self._version
+
+    def analyze(self, text: str) -> list:
+        """
+        Make morphology analysis for a text (see `Mystem.analyze`).
+        """
+        if _cache is None:
+            return self.analyzer.analyze(text)
+        analysis = _cache.get(text, self.version)
+        if analysis is None:
+            analysis = self.analyzer.analyze(text)
+            _cache.put(text, self.version, analysis)
+        return analysis
+
+    def analyze_many(self, texts: List[str], analyze_missing: Callable[[List[str]], List[list]]) -> List[list]:
+        """
+        Analyze several texts at once.
+
+        :param texts: Texts to analyze.
+        :param analyze_missing: A function analyzing the texts which are not in the cache
+            (it's given a list of texts and returns a list of analyses the same as `analyze` returns).
+
+        :return: A list of analyses.
+        """
+        if _cache is None:
+            return analyze_missing(texts)
+        results = [_cache.get(text, self.version) for text in texts]
+        missing = [num for num, analysis in enumerate(results) if analysis is None]
+        for num, analysis in zip(missing, analyze_missing([texts[num] for num in missing])):
+            results[num] = analysis
+            _cache.put(texts[num], self.version, analysis)
+        return results
+
+    def lemmatize(self, text: str) -> List[str]:
+        """
+        Get a list of lemmas of a text (see `Mystem.lemmatize`).
+        """
+        lemmas = []
+        for token in self.analyze(text):
+            try:
+                lemma = token["analysis"][0]["lex"]
+            except (KeyError, IndexError):
+                lemma = token.get("text")
+            if lemma:
+                lemmas.append(lemma)
+        return lemmas
+
+    def __getattr__(self, item):
+        return getattr(self.analyzer, item)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="A script managing a cache of Mystem analyses.")
+    parser.add_argument("cache", type=str, metavar="PATH", help="a path to a cache file")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    subparsers.add_parser("stats", help="print a number of entries and a size limit")
+    clear = subparsers.add_parser("clear", help="remove cached analyses")
+    clear.add_argument("--outdated", action="store_true",
+                       help="remove only analyses produced by a Mystem version other than the current one "
+                            "or cached in an earlier format")
+    limit = subparsers.add_parser("limit", help="set a maximal number of entries")
+    limit.add_argument("max_entries", type=int, metavar="NUM")
+    parsed = parser.parse_args()
+    parsed.cache = os.path.expanduser(os.path.abspath(parsed.cache))
+    return parsed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "limit":
+        assert args.max_entries > 0
+        cache = AnalysisCache(args.cache, args.max_entries)
+        cache.evict()
+    else:
+        cache = AnalysisCache(args.cache)
+    if args.command == "clear":
+        if args.outdated:
+            from mystem_pool import POOL
+            cache.clear(cache_version(POOL))
+        else:
+            cache.clear()
+    print("Entries: {}, limit: {}".format(len(cache), cache.max_entries), file=sys.stderr)
+    cache.close()
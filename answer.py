@@ -3,15 +3,31 @@ import functools
 import itertools
 import logging
 import re
-from typing import Union, Iterable, Tuple, List
+import threading
+from typing import Union, Iterable, Iterator, Tuple, List
 
 import editdistance
-import enchant
 
-from generalling import pos
-from pymystem3 import Mystem
+import instrumentation
+from generalling import GLOBAL_MYSTEM, POS_TABLE, SPELLING_CACHE, analyze_batch, pos
+from startup_profile import timed
+
+mystem = GLOBAL_MYSTEM
+
+
+def _lemma(token: dict) -> str:
+    """
+    Get a lemma of a token of Mystem's analysis (the same way `Mystem.lemmatize` does).
+
+    :param token: A token of Mystem's analysis.
+
+    :return: A lemma, or a token text if the token isn't analyzed.
+    """
+    try:
+        return token["analysis"][0]["lex"]
+    except (KeyError, IndexError):
+        return token.get("text")
 
-mystem = Mystem()
 
 class Answer(object):
     """
@@ -19,17 +35,22 @@ class Answer(object):
     """
     __russian_letter = re.compile(r"[а-яё]", flags=re.I)
 
-    def __init__(self, string, line=-1):
+    def __init__(self, string, line=-1, analysis=None, pos_func=pos):
         """
         Create a new answer instance.
 
         :param string: a text of an answer 'as is'.
+        :param analysis: Mystem's analysis of the stripped text, if it's already available.
+        :param pos_func: a function to detect a part of speech of a lemma.
         """
         self.line = line
         self._src = string.strip()
-        lemmas = [(i.strip(), pos(i)) for i in mystem.lemmatize(self._src) if i.strip()]
+        with instrumentation.answer(self._src), instrumentation.timed("answer analysis"):
+            if analysis is None:
+                analysis = mystem.analyze(self._src)
+            lemmas = [(i.strip(), pos_func(i)) for i in map(_lemma, analysis) if i and i.strip()]
         self._lemmas = list(itertools.dropwhile(lambda a: all(not i.isalpha() for i in a[0] or not a[0]), lemmas))
-        text = [i["text"] for i in mystem.analyze(self._src) if i["text"].strip()]
+        text = [i["text"] for i in analysis if i["text"].strip()]
         self._text = text[len(text) - len(self._lemmas):]
         assert len(self._text) == len(self._lemmas), "A number of word forms is not equal to a number of lemmas."
 
@@ -65,146 +86,220 @@ class Answer(object):
         return [p for i, p in self._lemmas]
 
 
+def iter_answers(answers: Iterable[Tuple[int, str]], batch_size=500) -> Iterator[Answer]:
+    """
+    Create answer instances analyzing their texts in batches (see `analyze_batch`).
+
+    :param answers: Pairs (line number, answer text), e.g. the ones `readers.read_columns` returns.
+    :param batch_size: A number of answers to send to Mystem at once.
+
+    :return: An iterator over answers in the order they're given.
+    """
+    answers = iter(answers)
+    while True:
+        batch = list(itertools.islice(answers, batch_size))
+        if not batch:
+            return
+        texts = [text.strip() for _, text in batch]
+        analyses = analyze_batch(texts, mystem, batch_size)
+        # Parts of speech of all the lemmas of a batch are resolved at once.
+        POS_TABLE.warm_up(
+            lemma.strip() for analysis in analyses for lemma in map(_lemma, analysis) if lemma and lemma.strip()
+        )
+        for (line, text), analysis in zip(batch, analyses):
+            yield Answer(text, line, analysis)
+
+
 class SpellChecker(object):
     """
     A class acting as a factory of functions performing string's spell check.
     """
 
     def __init__(self, dict_name, *wordlists):
-        if not enchant.dict_exists(dict_name):
-            raise ValueError("A dictionary ")
-        self.spellcheck_dict = enchant.Dict(dict_name)
-        for word in itertools.chain(*wordlists):
+        with timed("enchant dictionary " + dict_name):
+            import enchant
+            if not enchant.dict_exists(dict_name):
+                raise ValueError("A dictionary ")
+            self.spellcheck_dict = enchant.Dict(dict_name)
+        words = list(itertools.chain(*wordlists))
+        for word in words:
             self.spellcheck_dict.add_to_session(word)
+        self._cache_namespace = SPELLING_CACHE.namespace(dict_name, words)
+        # Enchant dictionaries can't be used by several threads at once.
+        self._lock = threading.Lock()
 
+    @instrumentation.measured("spellcheck")
     def __call__(self, text: Iterable[Tuple[str, bool]]) -> List[str]:
 
-        @functools.lru_cache(maxsize=300)
         def spellcheckme(word):
-            if self.spellcheck_dict.is_added(word) or self.spellcheck_dict.check(word):
+            if self.spellcheck_dict.is_added(word) or SPELLING_CACHE.check(
+                    self._cache_namespace, self.spellcheck_dict, word):
                 return word
-            suggestions = list(filter(lambda a: " " not in a, self.spellcheck_dict.suggest(word)))
+            suggestions = list(filter(
+                lambda a: " " not in a, SPELLING_CACHE.suggest(self._cache_namespace, self.spellcheck_dict, word)
+            ))
 
             if not suggestions or word in suggestions:
                 return word
             else:
                 return min(suggestions, key=functools.cmp_to_key(editdistance.eval))
 
-        return [spellcheckme(word) if is_questionable else word for word, is_questionable in text]
+        with self._lock:
+            return [spellcheckme(word) if is_questionable else word for word, is_questionable in text]
+
+
+class _LazySpellChecker(object):
+    """
+    A class attribute creating a spellchecker on first access, so that importing the module doesn't load enchant.
+    """
+
+    def __init__(self, dict_name, *wordlists):
+        self._args = (dict_name,) + wordlists
+        self._spellchecker = None
+        self._lock = threading.Lock()
+
+    def __get__(self, instance, owner) -> SpellChecker:
+        if self._spellchecker is None:
+            with self._lock:
+                if self._spellchecker is None:
+                    self._spellchecker = SpellChecker(*self._args)
+        return self._spellchecker
+
+
+class _AnswerAnalysis(object):
+    """
+    Lemmas and grammars of an answer computed once.
+    """
+    __slots__ = ("lemmas", "grammars")
+
+    def __init__(self, lemmas: Tuple[str, ...], grammars: Tuple[str, ...]):
+        self.lemmas = lemmas
+        self.grammars = grammars
 
 
 class BaseAnswer(object, metaclass=abc.ABCMeta):
     """
     A base class to represent an answer.
     """
-    _mystem = Mystem()
+    __slots__ = ("include_punctuation", "src", "full_data", "_raw_words", "_has_analysis", "_is_whitespace",
+                 "_analysis")
 
-    def __init__(self, text: str, include_punctuation: bool):
+    _mystem = GLOBAL_MYSTEM
+
+    def __init__(self, text: str, include_punctuation: bool, analysis: Union[list, None] = None):
         """
         :param str text: A text of an answer.
         :param bool include_punctuation: A flag showing whether it's necessary to
             include punctuation in lemma representation of the text.
+        :param analysis: Mystem's analysis of the text, if it's already available.
         """
         self.include_punctuation = include_punctuation
 
         self.src = text
-        full_data = self._mystem.analyze(text)
-        self._raw_words = [i["text"] for i in full_data]
-        self._has_analysis = [bool(i.get("analysis", False)) for i in full_data]
-        self._is_whitespace = [
+        full_data = self._mystem.analyze(text) if analysis is None else analysis
+        self._raw_words = tuple(i["text"] for i in full_data)
+        self._has_analysis = tuple(bool(i.get("analysis", False)) for i in full_data)
+        self._is_whitespace = tuple(
             False if self._has_analysis[num]
             else not bool(self._raw_words[num].strip())
             for num in range(len(full_data))
-            ]
+            )
         self.full_data = full_data
+        self._analysis = None
 
     @abc.abstractmethod
-    def to_lemmas(self):
+    def _tokens(self) -> Iterable[dict]:
         """
-        Get a list of lemmas of the text saved.
+        Get Mystem's analyses of the tokens lemmas and grammars are taken from.
 
-        :return: A list of lemmas.
+        :return: An iterable of token analyses.
         """
 
-    def apply_negation_parser(self, parsing_func):
-        return parsing_func(self.to_lemmas())
-
+    def _get_analysis(self) -> _AnswerAnalysis:
+        if self._analysis is None:
+            lemmas, grammars = [], []
+            for num, wd in enumerate(self._tokens()):
+                if self._has_analysis[num]:
+                    lemmas.append(wd["analysis"][0]["lex"])
+                    grammars.append(wd["analysis"][0].get("gr", ""))
+                else:
+                    lemmas.append(wd["text"])
+                    grammars.append("")
+            if self.include_punctuation:
+                kept = [num for num in range(len(lemmas)) if not self._is_whitespace[num]]
+            else:
+                kept = [num for num in range(len(lemmas)) if self._has_analysis[num]]
+            self._analysis = _AnswerAnalysis(
+                tuple(lemmas[num].strip().lower() for num in kept),
+                tuple(grammars[num].strip() for num in kept),
+            )
+        return self._analysis
+
+    def to_lemmas(self) -> Tuple[str, ...]:
+        """
+        Get lemmas of the text saved.
 
-class SimpleAnswer(BaseAnswer):
-    def to_lemmas(self):
-        lemmas = [
-            wd["analysis"][0]["lex"] if self._has_analysis[num]
-            else wd["text"]
-            for num, wd in enumerate(self.full_data)
-            ]
-        if self.include_punctuation:
-            return [wd.strip().lower() for num, wd in enumerate(lemmas) if not self._is_whitespace[num]]
-        else:
-            return [wd.strip().lower() for num, wd in enumerate(lemmas) if self._has_analysis[num]]
-
-    def grammars(self):
-        grs = [
-            wd["analysis"][0].get("gr", "") if self._has_analysis[num]
-            else ""
-            for num, wd in enumerate(self.full_data)
-            ]
-        if self.include_punctuation:
-            return [wd.strip() for num, wd in enumerate(grs) if not self._is_whitespace[num]]
-        else:
-            return [wd.strip() for num, wd in enumerate(grs) if self._has_analysis[num]]
+        :return: A tuple of lemmas.
+        """
+        return self._get_analysis().lemmas
 
+    def grammars(self) -> Tuple[str, ...]:
+        """
+        Get grammatical tags of the words of the text saved.
 
-class FullSpellcheckAnswer(BaseAnswer):
+        :return: A tuple of tags.
+        """
+        return self._get_analysis().grammars
 
-    spellchecker = SpellChecker("ru_RU")
+    def apply_negation_parser(self, parsing_func):
+        return parsing_func(self.to_lemmas())
 
     @property
     def _are_questionable(self):
-        return [
+        return tuple(
             True if self._has_analysis[num] and self.full_data[num]["analysis"][0].get("qual") == "bastard"
             else False
             for num in range(len(self.full_data))
-            ]
+            )
+
+    @property
+    def needs_spellcheck(self) -> bool:
+        """
+        Check whether any word of the text is unknown to Mystem, i.e. spellchecking may change the analysis.
+        """
+        return any(self._are_questionable)
+
+
+class SimpleAnswer(BaseAnswer):
+    __slots__ = ()
+
+    def _tokens(self):
+        return self.full_data
 
-    def to_lemmas(self):
-        spellchecked_words = self.spellchecker(zip(self._raw_words, self._are_questionable))
-        analyses = [
-            self._mystem.analyze(wd)[:-1]
-            if self._has_analysis[num] and spellchecked_words[num] != self._raw_words[num]
-            else [self.full_data[num]]
-            for num, wd in enumerate(spellchecked_words)
-            ]
-        lemmas = [
-            wd["analysis"][0]["lex"] if self._has_analysis[num]
-            else
-            wd["text"]
-            for num, wd in enumerate(itertools.chain(*analyses))
-            ]
 
-        if self.include_punctuation:
-            return [wd.strip().lower() for num, wd in enumerate(lemmas) if not self._is_whitespace[num]]
-        else:
-            return [wd.strip().lower() for num, wd in enumerate(lemmas) if self._has_analysis[num]]
+@functools.lru_cache(maxsize=20000)
+def _analyze_correction(word: str) -> list:
+    """
+    Analyze a word suggested by a spellchecker (without a trailing line break token).
+    The result is shared between calls and shouldn't be modified.
+    """
+    return BaseAnswer._mystem.analyze(word)[:-1]
+
+
+class FullSpellcheckAnswer(BaseAnswer):
+    __slots__ = ()
+
+    spellchecker = _LazySpellChecker("ru_RU")
 
-    def grammars(self):
+    def _tokens(self):
         spellchecked_words = self.spellchecker(zip(self._raw_words, self._are_questionable))
         analyses = [
-            self._mystem.analyze(wd)[:-1]
+            _analyze_correction(wd)
             if self._has_analysis[num] and spellchecked_words[num] != self._raw_words[num]
             else [self.full_data[num]]
             for num, wd in enumerate(spellchecked_words)
             ]
-        grammars = [
-            wd["analysis"][0].get("gr", "") if self._has_analysis[num]
-            else
-            ""
-            for num, wd in enumerate(itertools.chain(*analyses))
-            ]
-
-        if self.include_punctuation:
-            return [wd.strip() for num, wd in enumerate(grammars) if not self._is_whitespace[num]]
-        else:
-            return [wd.strip() for num, wd in enumerate(grammars) if self._has_analysis[num]]
+        return itertools.chain(*analyses)
 
 
 # class PartialSpellckeckAnswer(SimpleAnswer, FullSpellcheckAnswer):
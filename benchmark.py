@@ -0,0 +1,414 @@
+#!/usr/local/bin/python3
+"""
+A throughput benchmark of the scripts of the package on synthetic survey tables.
+
+A table of a given size is generated from the words of the dictionaries (see `generate`), then
+tagging_by_keywords.py, like_processing.py and each n-gram mode of keyword_extractor.py are run on it one by one.
+For each stage, answers per second, Mystem requests and process starts, enchant calls and peak RSS
+(of the script and of its Mystem processes) are measured and saved as JSON, so that runs on different
+commits can be compared (see the `compare` command).
+
+With `--standin`, the stages use mystem_standin.py instead of the Mystem binary, so the results don't depend on
+Mystem being installed and the stages' outputs are reproducible.
+
+The `sentences` command compares splitting answers into sentences with Punkt alone and with
+sentence_splitter.py on a table of answers and checks that the results are the same.
+"""
+
+import argparse
+import atexit
+import csv
+import datetime
+import glob
+import json
+import os
+import random
+import re
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import OrderedDict
+from typing import List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STANDIN = os.path.join(ROOT, "mystem_standin.py")
+
+COLUMNS = 16
+WORD = re.compile(r"^[а-яё]+$")
+
+# A column of an answer tagged by tagging_by_keywords.py and columns keyword_extractor.py gets n-grams from.
+TAGGING_COLUMN = 2
+KEYWORD_COLUMNS = [2, 3]
+TAGGING_DICTIONARY = os.path.join(ROOT, "dictionaries", "wishes", "sennaya-2016-12-12.csv")
+LIKE_DICTIONARIES = os.path.join(ROOT, "dictionaries", "likes", "sennaya")
+
+STAGES = ("tagging", "like", "keywords-1", "keywords-2", "keywords-3")
+
+METRICS = ("answers_per_second", "seconds", "mystem_requests", "mystem_starts", "enchant_calls", "peak_rss_kb",
+           "mystem_peak_rss_kb")
+
+
+def dictionary_words(directory: str = os.path.join(ROOT, "dictionaries")) -> List[str]:
+    """
+    Collect words of dictionaries (all the cells of csv files but tags, the first fields of txt files).
+
+    :return: A sorted list of words.
+    """
+    words = set()
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.*"), recursive=True)):
+        if not path.endswith((".csv", ".txt")):
+            continue
+        with open(path) as f:
+            for line in csv.reader(f):
+                cells = line[1:] if path.endswith(".csv") else line[:1]
+                for cell in cells:
+                    words.update(i for i in cell.lower().split() if WORD.match(i))
+    return sorted(words)
+
+
+def generate(path: str, rows: int, seed: int = 0, typos: float = 0.05):
+    """
+    Generate a table of survey answers made of dictionary words.
+
+    The first column is a respondent's id, the other ones are answers: one to three phrases separated
+    with commas, conjunctions or sentence breaks, some of them negated, some cells empty.
+
+    :param path: A path to save the table to.
+    :param rows: A number of respondents.
+    :param seed: A seed of the random generator.
+    :param typos: A share of words with a typo (a letter repeated three times).
+    """
+    rng = random.Random(seed)
+    words = dictionary_words()
+
+    def word():
+        wd = rng.choice(words)
+        if len(wd) > 2 and rng.random() < typos:
+            pos = rng.randrange(1, len(wd))
+            wd = wd[:pos] + wd[pos] * 2 + wd[pos:]
+        return wd
+
+    def answer():
+        if rng.random() < 0.1:
+            return ""
+        phrases = []
+        for _ in range(rng.choice((1, 1, 2, 3))):
+            phrase = " ".join(word() for _ in range(rng.choice((1, 1, 2, 3))))
+            phrases.append(("не " if rng.random() < 0.15 else "") + phrase)
+        text = phrases[0]
+        for phrase in phrases[1:]:
+            text += rng.choice((", ", " и ", ". ", "; ")) + phrase
+        return text[0].upper() + text[1:]
+
+    with open(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id"] + ["question {}".format(i) for i in range(2, COLUMNS + 1)])
+        for num in range(1, rows + 1):
+            writer.writerow([num] + [answer() for _ in range(2, COLUMNS + 1)])
+
+
+def count_answers(path: str, columns: List[int]) -> int:
+    """
+    Count non-empty cells of a table in the columns given (starting from 1).
+    """
+    with open(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return sum(1 for line in reader for i in columns if i <= len(line) and line[i - 1].strip())
+
+
+def stages(table: str, workdir: str) -> "OrderedDict[str, tuple]":
+    """
+    :return: Stages of the benchmark: a name -> (a script, its arguments, numbers of columns it processes).
+    """
+    result = OrderedDict()
+    result["tagging"] = (
+        "tagging_by_keywords.py",
+        [table, str(TAGGING_COLUMN), TAGGING_DICTIONARY, "-p", "sennaya", "-o", os.path.join(workdir, "tagging")],
+        [TAGGING_COLUMN]
+    )
+    result["like"] = ("like_processing.py", ["like", table, LIKE_DICTIONARIES], like_columns())
+    for n in (1, 2, 3):
+        result["keywords-{}".format(n)] = (
+            "keyword_extractor.py", [table] + [str(i) for i in KEYWORD_COLUMNS] + ["-n", str(n)], KEYWORD_COLUMNS
+        )
+    return result
+
+
+def _peak_rss_kb(who) -> int:
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_instrumented(counters_path: str, script: str, args: List[str]):
+    """
+    Run a script counting Mystem and enchant calls; the counters are saved to a JSON file at exit.
+    It's run in a child process of `run_stage`.
+    """
+    from pymystem3 import Mystem
+
+    counters = OrderedDict((i, 0) for i in ("mystem_requests", "mystem_starts", "enchant_calls"))
+
+    def counting(cls, method, counter):
+        original = getattr(cls, method)
+
+        def wrapper(*a, **kw):
+            counters[counter] += 1
+            return original(*a, **kw)
+
+        setattr(cls, method, wrapper)
+
+    counting(Mystem, "_analyze_impl", "mystem_requests")
+    counting(Mystem, "_start_mystem", "mystem_starts")
+    try:
+        import enchant
+    except ImportError:
+        pass
+    else:
+        for method in ("check", "suggest"):
+            counting(enchant.Dict, method, "enchant_calls")
+
+    # Registered first, so it's called after the scripts' own exit handlers stop Mystem processes.
+    @atexit.register
+    def save():
+        counters["peak_rss_kb"] = _peak_rss_kb(resource.RUSAGE_SELF)
+        counters["mystem_peak_rss_kb"] = _peak_rss_kb(resource.RUSAGE_CHILDREN)
+        with open(counters_path, "w") as f:
+            json.dump(counters, f)
+
+    # Imported after `save` is registered, so the pool's exit handler stops Mystem processes before it's called.
+    import mystem_pool
+    # Lines sent to Mystem at once make one request (see MystemPool.analyze_lines).
+    counting(mystem_pool, "request_lines", "mystem_requests")
+
+    sys.argv = [script] + args
+    sys.path.insert(0, ROOT)
+    runpy.run_path(os.path.join(ROOT, script), run_name="__main__")
+
+
+def run_stage(name: str, script: str, args: List[str], answers: int, workdir: str, env: dict) -> OrderedDict:
+    """
+    Run a stage in a separate process and measure it.
+
+    :return: Metrics of the stage.
+    """
+    counters_path = os.path.join(workdir, name + ".counters.json")
+    log_path = os.path.join(workdir, name + ".log")
+    command = [sys.executable, os.path.abspath(__file__), "_stage", counters_path, script, "--"] + args
+    with open(os.path.join(workdir, name + ".out"), "w") as out, open(log_path, "w") as log:
+        start = time.perf_counter()
+        returncode = subprocess.call(command, stdout=out, stderr=log, env=env, cwd=workdir)
+        seconds = time.perf_counter() - start
+    if returncode:
+        with open(log_path) as f:
+            sys.stderr.write("".join(f.readlines()[-20:]))
+        raise RuntimeError("Stage {} failed with code {}, see {}".format(name, returncode, log_path))
+    with open(counters_path) as f:
+        counters = json.load(f)
+    metrics = OrderedDict([("answers", answers), ("seconds", round(seconds, 3)),
+                           ("answers_per_second", round(answers / seconds, 1))])
+    metrics.update(counters)
+    return metrics
+
+
+def read_answers(path: str, columns: List[int]) -> List[str]:
+    """
+    Read non-empty cells of a table in the columns given (starting from 1).
+    """
+    with open(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [line[i - 1] for line in reader for i in columns if i <= len(line) and line[i - 1].strip()]
+
+
+def like_columns() -> List[int]:
+    with open(os.path.join(LIKE_DICTIONARIES, "colnums.json")) as f:
+        return json.load(f)["like"]
+
+
+def benchmark_sentences(answers: List[str], repeat: int = 3) -> OrderedDict:
+    """
+    Compare splitting answers into sentences with Punkt alone and with `sentence_splitter.SentenceSplitter`.
+
+    Each run of the splitter starts with an empty cache, as a run of like_processing.py does;
+    the Punkt model is loaded before timing.
+
+    :return: Metrics: the best times of both ways, the speedup and whether all the results are identical.
+    """
+    from sentence_splitter import SentenceSplitter
+
+    def best_time(make_splitter):
+        times = []
+        for _ in range(repeat):
+            splitter = make_splitter()
+            splitter.load()
+            start = time.perf_counter()
+            for text in answers:
+                splitter(text)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    punkt = SentenceSplitter(fast_path=False, cache_size=0)
+    splitter = SentenceSplitter()
+    identical = all(punkt(text) == splitter(text) for text in answers)
+    punkt_seconds = best_time(lambda: SentenceSplitter(fast_path=False, cache_size=0))
+    splitter_seconds = best_time(SentenceSplitter)
+    return OrderedDict([
+        ("answers", len(answers)),
+        ("distinct_answers", len(set(answers))),
+        ("single_sentence_share", round(sum(map(SentenceSplitter.is_single_sentence, answers)) / len(answers), 3)),
+        ("punkt_seconds", round(punkt_seconds, 4)),
+        ("splitter_seconds", round(splitter_seconds, 4)),
+        ("speedup", round(punkt_seconds / splitter_seconds, 2)),
+        ("identical", identical),
+    ])
+
+
+def sentences(parsed) -> OrderedDict:
+    columns = parsed.columns or like_columns()
+    if parsed.table:
+        return benchmark_sentences(read_answers(os.path.expanduser(parsed.table), columns), parsed.repeat)
+    workdir = tempfile.mkdtemp(prefix="sennaya-benchmark-")
+    try:
+        table = os.path.join(workdir, "survey.csv")
+        generate(table, parsed.rows, parsed.seed, parsed.typos)
+        return benchmark_sentences(read_answers(table, columns), parsed.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(parsed) -> OrderedDict:
+    workdir = tempfile.mkdtemp(prefix="sennaya-benchmark-")
+    try:
+        table = os.path.join(workdir, "survey.csv")
+        generate(table, parsed.rows, parsed.seed, parsed.typos)
+        os.mkdir(os.path.join(workdir, "tagging"))
+        env = dict(os.environ, PYTHONHASHSEED="0")
+        if parsed.standin:
+            env["MYSTEM_BIN"] = STANDIN
+        results = OrderedDict([
+            ("revision", git_revision()),
+            ("date", datetime.datetime.now().isoformat(timespec="seconds")),
+            ("python", sys.version.split()[0]),
+            ("mystem", "stand-in" if parsed.standin else env.get("MYSTEM_BIN", "default")),
+            ("rows", parsed.rows), ("seed", parsed.seed), ("typos", parsed.typos),
+            ("stages", OrderedDict()),
+        ])
+        for name, (script, args, columns) in stages(table, workdir).items():
+            if parsed.stages and name not in parsed.stages:
+                continue
+            print("Running {}...".format(name), file=sys.stderr)
+            metrics = run_stage(name, script, args, count_answers(table, columns), workdir, env)
+            results["stages"][name] = metrics
+            print("  " + ", ".join("{}: {}".format(k, v) for k, v in metrics.items()), file=sys.stderr)
+        return results
+    finally:
+        if parsed.keep:
+            print("Stage outputs are kept in {}".format(workdir), file=sys.stderr)
+        else:
+            shutil.rmtree(workdir)
+
+
+def compare(old: dict, new: dict, file=sys.stdout):
+    """
+    Print changes of metrics of stages between two runs.
+    """
+    print("{} -> {}".format(old.get("revision", "?")[:10], new.get("revision", "?")[:10]), file=file)
+    for name, metrics in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        print(name, file=file)
+        for metric in METRICS:
+            before, after = old["stages"][name].get(metric), metrics.get(metric)
+            if before is None or after is None:
+                continue
+            change = "{:+.1f}%".format(100.0 * (after - before) / before) if before else ""
+            print("  {:<22} {:>12} {:>12} {:>9}".format(metric, before, after, change), file=file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="A script measuring throughput of the package's scripts.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="generate a table, run the scripts on it and save metrics")
+    run_parser.add_argument("-o", "--output", type=str, metavar="PATH", help="a path to save metrics (JSON) to")
+    run_parser.add_argument("-r", "--rows", type=int, default=1000, metavar="NUM",
+                            help="a number of rows of a table to generate")
+    run_parser.add_argument("--seed", type=int, default=0, metavar="NUM", help="a seed of the table generator")
+    run_parser.add_argument("--typos", type=float, default=0.05, metavar="SHARE",
+                            help="a share of words with typos in the table")
+    run_parser.add_argument("-s", "--stages", type=str, nargs="+", choices=STAGES, metavar="NAME",
+                            help="stages to run ({}; all by default)".format(", ".join(STAGES)))
+    run_parser.add_argument("--standin", action="store_true",
+                            help="use mystem_standin.py instead of Mystem (deterministic, no binary needed)")
+    run_parser.add_argument("--keep", action="store_true", help="keep the table and the outputs of the stages")
+
+    generate_parser = subparsers.add_parser("generate", help="only generate a table")
+    generate_parser.add_argument("table", type=str, metavar="PATH", help="a path to save the table to")
+    generate_parser.add_argument("-r", "--rows", type=int, default=1000, metavar="NUM")
+    generate_parser.add_argument("--seed", type=int, default=0, metavar="NUM")
+    generate_parser.add_argument("--typos", type=float, default=0.05, metavar="SHARE")
+
+    compare_parser = subparsers.add_parser("compare", help="compare metrics of two runs")
+    compare_parser.add_argument("old", type=str, metavar="PATH")
+    compare_parser.add_argument("new", type=str, metavar="PATH")
+
+    sentences_parser = subparsers.add_parser(
+        "sentences", help="compare splitting answers into sentences with Punkt alone and with the sentence splitter"
+    )
+    sentences_parser.add_argument("table", type=str, nargs="?", metavar="PATH",
+                                  help="a table of answers (a table is generated if it's not given)")
+    sentences_parser.add_argument("-c", "--columns", type=int, nargs="+", metavar="NUM",
+                                  help="numbers of columns with answers (the columns of likes by default)")
+    sentences_parser.add_argument("--repeat", type=int, default=3, metavar="NUM", help="a number of runs to time")
+    sentences_parser.add_argument("-r", "--rows", type=int, default=1000, metavar="NUM")
+    sentences_parser.add_argument("--seed", type=int, default=0, metavar="NUM")
+    sentences_parser.add_argument("--typos", type=float, default=0.05, metavar="SHARE")
+
+    stage_parser = subparsers.add_parser("_stage")
+    stage_parser.add_argument("counters", type=str)
+    stage_parser.add_argument("script", type=str)
+    stage_parser.add_argument("args", nargs=argparse.REMAINDER)
+
+    parsed = parser.parse_args()
+    if parsed.command in ("run", "generate", "sentences"):
+        assert parsed.rows > 0
+        assert 0 <= parsed.typos <= 1
+    return parsed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        metrics = run(args)
+        if args.output:
+            with open(os.path.expanduser(args.output), "w") as f:
+                json.dump(metrics, f, ensure_ascii=False, indent=2)
+        else:
+            json.dump(metrics, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+    elif args.command == "generate":
+        generate(os.path.expanduser(os.path.abspath(args.table)), args.rows, args.seed, args.typos)
+    elif args.command == "sentences":
+        json.dump(sentences(args), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.command == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+    else:
+        run_instrumented(args.counters, args.script, args.args[1:] if args.args[:1] == ["--"] else args.args)
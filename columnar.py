@@ -0,0 +1,226 @@
+#!/usr/local/bin/python3
+"""
+A columnar storage of survey tables.
+
+A table is parsed once and saved to a directory: each column is a UTF-8 blob of its cells
+and an array of cell offsets. Files are memory-mapped when read, so any set of columns is available
+without parsing the whole table again.
+"""
+
+import argparse
+import array
+import csv
+import json
+import mmap
+import os
+import sys
+
+from typing import Iterator, List, Union
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+# Offsets and row lengths are stored as unsigned 64-bit integers in the native byte order.
+_OFFSET_TYPE = "Q"
+
+
+def is_columnar(path: str) -> bool:
+    """
+    Check whether a path points to a table saved with `ingest`.
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _column_paths(directory, num):
+    return os.path.join(directory, "col_{}.txt".format(num)), os.path.join(directory, "col_{}.offsets".format(num))
+
+
+def ingest(csv_path: str, directory: str, delimiter=","):
+    """
+    Parse a CSV table and save it in the columnar format.
+
+    :param csv_path: A path to a table.
+    :param directory: A directory to save the table to (it's created if it doesn't exist).
+    :param delimiter: A delimiter of the table.
+
+    :return: A number of rows saved (including a header).
+    """
+    os.makedirs(directory, exist_ok=True)
+    blobs, offsets = [], []
+    lengths = array.array(_OFFSET_TYPE)
+    try:
+        with open(csv_path) as f:
+            for row_num, line in enumerate(csv.reader(f, delimiter=delimiter)):
+                lengths.append(len(line))
+                while len(blobs) < len(line):
+                    # A column appearing for the first time is empty in all the previous rows.
+                    num = len(blobs)
+                    blob_path, _ = _column_paths(directory, num)
+                    blobs.append(open(blob_path, "wb"))
+                    offsets.append(array.array(_OFFSET_TYPE, [0] * (row_num + 1)))
+                for num, blob in enumerate(blobs):
+                    if num < len(line):
+                        blob.write(line[num].encode("utf-8"))
+                    offsets[num].append(blob.tell())
+    finally:
+        for blob in blobs:
+            blob.close()
+
+    for num, column_offsets in enumerate(offsets):
+        _, offsets_path = _column_paths(directory, num)
+        with open(offsets_path, "wb") as f:
+            column_offsets.tofile(f)
+    with open(os.path.join(directory, "lengths"), "wb") as f:
+        lengths.tofile(f)
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "source": os.path.abspath(csv_path),
+            "rows": len(lengths),
+            "columns": len(blobs),
+            "byteorder": sys.byteorder,
+        }, f, ensure_ascii=False, indent=2)
+    return len(lengths)
+
+
+class _MappedArray(object):
+    """
+    A read-only array of integers mapped from a file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.values = memoryview(self._map).cast(_OFFSET_TYPE)
+        else:
+            self._map = None
+            self.values = array.array(_OFFSET_TYPE)
+
+    def close(self):
+        if self._map is not None:
+            self.values.release()
+            self._map.close()
+        self._file.close()
+
+
+class _Column(object):
+    """
+    Cells of a column: a memory-mapped blob and offsets of cells in it.
+    """
+
+    def __init__(self, directory, num):
+        blob_path, offsets_path = _column_paths(directory, num)
+        self._file = open(blob_path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.blob = memoryview(self._map)
+        else:
+            self._map, self.blob = None, memoryview(b"")
+        self.offsets = _MappedArray(offsets_path)
+
+    def __getitem__(self, row: int) -> str:
+        offsets = self.offsets.values
+        return str(self.blob[offsets[row]:offsets[row + 1]], "utf-8")
+
+    def close(self):
+        self.offsets.close()
+        if self._map is not None:
+            self.blob.release()
+            self._map.close()
+        self._file.close()
+
+
+class ColumnarTable(object):
+    """
+    A table saved with `ingest`. Columns are numbered from 0 and opened on first access.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest["version"] != FORMAT_VERSION or manifest["byteorder"] != sys.byteorder:
+            raise ValueError("Unsupported columnar format: version {}, {} byte order".format(
+                manifest["version"], manifest["byteorder"]))
+        self.directory = directory
+        self.rows_number = manifest["rows"]
+        self.columns_number = manifest["columns"]
+        self._lengths = _MappedArray(os.path.join(directory, "lengths"))
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows_number
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _column(self, num) -> _Column:
+        if num not in self._columns:
+            self._columns[num] = _Column(self.directory, num)
+        return self._columns[num]
+
+    def row_length(self, row: int) -> int:
+        """
+        Get a number of cells in a row of the source table.
+        """
+        return self._lengths.values[row]
+
+    def cells(self, num: int) -> Iterator[Union[str, None]]:
+        """
+        Iterate over cells of a column.
+
+        :param num: A number of a column (starting from 0).
+
+        :return: An iterator over cells; None is yielded for rows which are too short to have the column.
+        """
+        if num >= self.columns_number:
+            return (None for _ in range(self.rows_number))
+        column = self._column(num)
+        return (column[row] if num < self.row_length(row) else None for row in range(self.rows_number))
+
+    def rows(self, columns: Union[List[int], None] = None) -> Iterator[List[str]]:
+        """
+        Iterate over rows as they're read by `csv.reader`.
+
+        :param columns: Numbers of columns to read (starting from 0). Other cells are replaced with empty strings.
+            By default, all the columns are read.
+
+        :return: An iterator over lists of cells.
+        """
+        wanted = range(self.columns_number) if columns is None else [i for i in columns if i < self.columns_number]
+        wanted = [(num, self._column(num)) for num in wanted]
+        for row in range(self.rows_number):
+            line = [""] * self.row_length(row)
+            for num, column in wanted:
+                if num < len(line):
+                    line[num] = column[row]
+            yield line
+
+    def close(self):
+        for column in self._columns.values():
+            column.close()
+        self._columns = {}
+        self._lengths.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="A script converting a survey table to the columnar format.")
+    parser.add_argument("csv", type=str, metavar="PATH", help="a path to a csv table")
+    parser.add_argument("output", type=str, metavar="DIR", help="a directory to save the table to")
+    parser.add_argument("-d", "--delimiter", type=str, default=",", metavar="SYMBOL",
+                        help="a delimiter of the table")
+    parsed = parser.parse_args()
+    parsed.csv = os.path.expanduser(os.path.abspath(parsed.csv))
+    parsed.output = os.path.expanduser(os.path.abspath(parsed.output))
+    assert os.path.isfile(parsed.csv)
+    assert len(parsed.delimiter) == 1
+    return parsed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = ingest(args.csv, args.output, args.delimiter)
+    print("Rows saved: {}".format(rows), file=sys.stderr)
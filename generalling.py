@@ -2,14 +2,29 @@
 A module containing all commonly used project's linguistic things.
 """
 
-import enchant
+import atexit
+import hashlib
 import itertools
-import pymystem3
+import json
+import logging
+import os
 import re
+import threading
 
-from typing import Union, Tuple, List
+from collections import OrderedDict
+from typing import Iterable, Union, Tuple, List
 
-GLOBAL_MYSTEM = pymystem3.Mystem()
+import instrumentation
+from analysis_cache import CachingAnalyzer
+from mystem_pool import POOL
+from startup_profile import timed
+
+GLOBAL_MYSTEM = CachingAnalyzer(POOL)
+
+
+# A lemma compared with tokens of negations as a whole: a word or a run of punctuation.
+_PLAIN_LEMMA = re.compile(r'\w+|[^\w\s]+')
+_WORD = re.compile(r'\w+')
 
 
 class NegationParser(object):
@@ -21,8 +36,29 @@ class NegationParser(object):
         self._ignoring_dict = ignoring_dict
         self._neg_cut = re.compile(r'\b(' + r'|'.join(self._negation_dict.keys()) + r')\b')
         self._ignor_cut = None if self._ignoring_dict else re.compile(r'\b(' + r'|'.join(self._ignoring_dict.keys()) + r')\b')
+        self._neg_trie = self._compile_trie(self._negation_dict.keys())
         self._nps = re.compile(r'(?<!\b\w)\s*(?:[,]+| -)(?! (?:котор|\w{1,3}\s+котор|где|что|а |как))', flags=re.I)
 
+    @staticmethod
+    def _compile_trie(keys: Iterable[str]) -> Union[dict, None]:
+        """
+        Compile phrases into a trie of their words: a node is a dict mapping a word to a child node,
+        and the node a phrase ends in maps None to a pair (a number of the phrase, the phrase).
+
+        :return: The root of the trie, or None if some phrase isn't a sequence of words separated by spaces
+            (e.g. it contains a regular expression).
+        """
+        root = {}
+        for num, key in enumerate(keys):
+            words = key.split(" ")
+            if not all(_WORD.fullmatch(word) for word in words):
+                return None
+            node = root
+            for word in words:
+                node = node.setdefault(word, {})
+            node.setdefault(None, (num, key))
+        return root
+
     @staticmethod
     def _cut_with_re(string, regex):
         if regex is None:
@@ -30,7 +66,7 @@ class NegationParser(object):
         m = regex.match(string)
         return (string.lstrip(), None) if not m else (string[len(m.group(1)):], m.group(1))
 
-    def parse_negations(self, lemmas: list) -> list:
+    def _strip_with_re(self, lemmas: list):
         text, update_text, last = " ".join(lemmas).lower(), None, None
         neg = True
         final_last = None
@@ -43,6 +79,34 @@ class NegationParser(object):
             if self._ignor_cut is not None:
                 update_text, last = self._cut_with_re(update_text, self._ignor_cut)
                 if last: final_last = last
+        return update_text, neg, final_last
+
+    def _strip_with_trie(self, lemmas: list):
+        # Negations are cut one after another from the beginning; of those starting at the same lemma,
+        # the first one in the dictionary is taken, as the alternation of _neg_cut does.
+        start, final_last, count = 0, None, len(lemmas)
+        while start < count:
+            node, found, pos = self._neg_trie, None, start
+            while pos < count:
+                lemma = lemmas[pos].lower()
+                node = node.get(lemma)
+                if node is None:
+                    if not lemma.isalnum() and not _PLAIN_LEMMA.fullmatch(lemma):
+                        # A lemma like "что-то" can end a negation in the middle: only the regex knows the rules.
+                        return None
+                    break
+                pos += 1
+                if None in node and (found is None or node[None][0] < found[0][0]):
+                    found = node[None], pos
+            if found is None:
+                break
+            (_, final_last), start = found
+        # _ignor_cut, if any, matches nothing but whitespace, which isn't left between the lemmas here.
+        return " ".join(lemmas[start:]).lower(), start == 0, final_last
+
+    def parse_negations(self, lemmas: list) -> list:
+        stripped = self._strip_with_trie(lemmas) if self._neg_trie is not None else None
+        update_text, neg, final_last = stripped or self._strip_with_re(lemmas)
 
         if final_last in self._negation_dict:
             previous_grammars = self._negation_dict[final_last]
@@ -51,7 +115,8 @@ class NegationParser(object):
 
         return update_text, neg, previous_grammars
 
-    def to_chunks(self, sentence, chunk_constructor):
+    @instrumentation.measured("negation chunking")
+    def to_chunks(self, sentence, chunk_constructor, analyzer=GLOBAL_MYSTEM):
 
         def grammar_is_analogous_to(previous_grammars, full_data):
             for word in full_data:
@@ -63,12 +128,26 @@ class NegationParser(object):
                     return True
             return False
 
+        supposed_parts = list(map(lambda a: a.strip(), self._nps.split(sentence)))
+
+        # All the chunks a sentence may be cut into are sent to Mystem in one request, one per line, so each of them
+        # is analyzed on its own, as if it were analyzed alone (see analyze_batch). An answer is made once per chunk.
+        chunks = list(OrderedDict.fromkeys(itertools.chain(
+            supposed_parts, itertools.chain.from_iterable(i.split(" и ") for i in supposed_parts if " и " in i)
+        )))
+        analyses, answers = dict(zip(chunks, analyze_batch(chunks, analyzer))), {}
+
+        def chunk_answer(chunk):
+            if chunk not in answers:
+                answers[chunk] = chunk_constructor(chunk, True, analyses[chunk])
+            return answers[chunk]
+
         def reorganize_nom_chunks(chunk):
             if " и " not in chunk:
                 return [chunk]
             subchunks = chunk.split(" и ")
             for subchunk in subchunks:
-                chunk_part = chunk_constructor(subchunk, True)
+                chunk_part = chunk_answer(subchunk)
                 nouns = list(filter(lambda gr: "S" in gr, chunk_part.grammars()))
                 if not nouns:
                     return [chunk]
@@ -76,12 +155,11 @@ class NegationParser(object):
                     return [chunk]
             return subchunks
 
-        supposed_parts = list(map(lambda a: a.strip(), self._nps.split(sentence)))
         supposed_parts = itertools.chain.from_iterable(reorganize_nom_chunks(part) for part in supposed_parts)
 
         resulting_chunks, current_chunk, chunk_is_positive, previous_grammars = [], [], True, None
         for chunk in supposed_parts:
-            sentence_part = chunk_constructor(chunk, True)
+            sentence_part = chunk_answer(chunk)
             words, is_negative, last_part_grammars = sentence_part.apply_negation_parser(lambda a: self.parse_negations(a))
 
             if not is_negative:
@@ -113,16 +191,7 @@ class NegationParser(object):
         return resulting_chunks
 
 
-def pos(wd, analyzer=GLOBAL_MYSTEM):
-    """
-    Determine a word's part of speech.
-
-    :param wd: A word to assign pos to.
-    :param analyzer: An analyzer to use to detect it.
-
-    :return: A text part-of-speech label or, if detection failed, None.
-    """
-    analyses = analyzer.analyze(wd)
+def _pos_of_analysis(analyses: list) -> Union[str, None]:
     if not analyses:
         return None
     dic = analyses[0]
@@ -135,18 +204,247 @@ def pos(wd, analyzer=GLOBAL_MYSTEM):
     return None
 
 
+def pos(wd, analyzer=GLOBAL_MYSTEM):
+    """
+    Determine a word's part of speech.
+
+    Words are looked up in POS_TABLE first, so it's worth resolving a whole vocabulary
+    with `POS_TABLE.warm_up` before asking for parts of speech of separate words.
+
+    :param wd: A word to assign pos to.
+    :param analyzer: An analyzer to use to detect it.
+
+    :return: A text part-of-speech label or, if detection failed, None.
+    """
+    if isinstance(analyzer, CachingAnalyzer):
+        return POS_TABLE.lookup(wd, analyzer)
+    return _pos_of_analysis(analyzer.analyze(wd))
+
+
+def analyze_batch(texts: List[str], analyzer=GLOBAL_MYSTEM, batch_size=500) -> List[list]:
+    """
+    Analyze a list of texts sending them to Mystem in large batches.
+
+    `Mystem.analyze` sends a text to Mystem line by line, waiting for an analysis of each line. Here lines of
+    all the texts are sent in one request, one per line, and Mystem analyzes each of them on its own as well
+    (see `MystemPool.analyze_lines`), so the analyses are the ones `analyzer.analyze(text)` returns.
+
+    :param texts: A list of texts to analyze.
+    :param analyzer: A Mystem instance to use.
+    :param batch_size: A maximal number of lines to send in one request.
+
+    :return: A list of analyses (one per text).
+    """
+    if isinstance(analyzer, CachingAnalyzer):
+        return analyzer.analyze_many(texts, lambda missing: analyze_batch(missing, analyzer.analyzer, batch_size))
+    if not hasattr(analyzer, "analyze_lines"):
+        return [analyzer.analyze(text) for text in texts]
+
+    results = [[] for _ in texts]
+    lines, owners = [], []
+    for num, text in enumerate(texts):
+        for line in text.splitlines():
+            lines.append(line)
+            owners.append(num)
+    for start in range(0, len(lines), batch_size):
+        analyses = analyzer.analyze_lines(lines[start:start + batch_size])
+        for num, analysis in zip(owners[start:start + batch_size], analyses):
+            results[num].extend(analysis)
+    return results
+
+
+class PosTable(object):
+    """
+    A table of parts of speech of words shared by all the callers of `pos` in a process.
+
+    Tags are kept per Mystem version (see `CachingAnalyzer.version`) and a format of the table,
+    and can be saved to a file to be reused by later runs. Tags saved in other formats are ignored.
+    """
+    # Tables of earlier formats may hold tags of words disambiguated by their neighbours in a batch.
+    FORMAT = 2
+
+    def __init__(self):
+        self.path = None
+        self.hits = self.misses = 0
+        self._tags = {}
+        self._changed = False
+
+    @classmethod
+    def _key(cls, version: str) -> str:
+        return "{} pos table {}".format(version, cls.FORMAT)
+
+    def _table(self, analyzer: CachingAnalyzer) -> dict:
+        return self._tags.setdefault(self._key(analyzer.version), {})
+
+    def warm_up(self, words: Iterable[str], analyzer: CachingAnalyzer = GLOBAL_MYSTEM):
+        """
+        Resolve parts of speech of words which are not in the table yet.
+
+        All the words are sent to Mystem in one request, one word per line, so each of them is analyzed on its own,
+        as `lookup` does (see `analyze_batch`).
+
+        :param words: Words to resolve.
+        :param analyzer: An analyzer to use.
+        """
+        table = self._table(analyzer)
+        missing = list(OrderedDict.fromkeys(word for word in words if word not in table))
+        for word, analysis in zip(missing, analyze_batch(missing, analyzer, max(len(missing), 1))):
+            table[word] = _pos_of_analysis(analysis)
+        self._changed = self._changed or bool(missing)
+
+    def lookup(self, word: str, analyzer: CachingAnalyzer = GLOBAL_MYSTEM) -> Union[str, None]:
+        """
+        Get a part of speech of a word, analyzing the word if it's not in the table.
+        """
+        table = self._table(analyzer)
+        if word in table:
+            self.hits += 1
+            return table[word]
+        self.misses += 1
+        tag = table[word] = _pos_of_analysis(analyzer.analyze(word))
+        self._changed = True
+        return tag
+
+    def load(self, path):
+        """
+        Load tags saved by a previous run and save them to the same file at exit.
+
+        :param path: A path to a JSON file (it's created if it doesn't exist).
+        """
+        self.path = path
+        if os.path.isfile(path):
+            with open(path) as f:
+                for key, tags in json.load(f).items():
+                    if key.endswith(self._key("")):
+                        self._tags.setdefault(key, {}).update(tags)
+                    else:
+                        # Tags of other formats are dropped when the table is saved.
+                        self._changed = True
+
+    def save(self):
+        if self.path is None or not self._changed:
+            return
+        with open(self.path, "w") as f:
+            json.dump(self._tags, f, ensure_ascii=False)
+        self._changed = False
+
+
+POS_TABLE = PosTable()
+
+
+@atexit.register
+def _save_pos_table():
+    if POS_TABLE.hits or POS_TABLE.misses:
+        logging.info("POS table: %d hits, %d misses", POS_TABLE.hits, POS_TABLE.misses)
+    POS_TABLE.save()
+
+
+class SpellingCache(object):
+    """
+    A bounded cache of spellchecker calls shared by all spellcheckers of a process.
+
+    Results are kept per namespace, i.e. per a dictionary name and a list of words added to a session,
+    since the latter may change suggestions. Least recently used results are dropped first.
+    """
+
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.path = None
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(dict_name, session_words) -> str:
+        """
+        Make a namespace identifying a spellchecker.
+
+        :param dict_name: A name of an enchant dictionary.
+        :param session_words: Words added to a session of the dictionary.
+
+        :return: A namespace string.
+        """
+        digest = hashlib.blake2b("\n".join(sorted(set(session_words))).encode("utf-8"), digest_size=8)
+        return "{}:{}".format(dict_name, digest.hexdigest())
+
+    def _get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        # Enchant is called without the lock, so other threads get cached results meanwhile.
+        # Threads missing the same word at once compute it each, which gives the same value.
+        with instrumentation.timed("enchant " + key[1]):
+            value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._trim()
+        return value
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def check(self, namespace, spellcheck_dict, word) -> bool:
+        return self._get((namespace, "check", word), lambda: spellcheck_dict.check(word))
+
+    def suggest(self, namespace, spellcheck_dict, word) -> List[str]:
+        return self._get((namespace, "suggest", word), lambda: list(spellcheck_dict.suggest(word)))
+
+    def load(self, path):
+        """
+        Load results saved by a previous run and save them to the same file at exit.
+
+        :param path: A path to a JSON file (it's created if it doesn't exist).
+        """
+        self.path = path
+        if os.path.isfile(path):
+            with open(path) as f:
+                entries = json.load(f)
+            with self._lock:
+                # Entries are saved from the least recently used, so the newest ones are kept.
+                for namespace, operation, word, value in entries:
+                    self._entries[(namespace, operation, word)] = value
+                self._trim()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            entries = [list(key) + [value] for key, value in self._entries.items()]
+        with open(self.path, "w") as f:
+            json.dump(entries, f, ensure_ascii=False)
+
+
+SPELLING_CACHE = SpellingCache()
+
+
+@atexit.register
+def _save_spelling_cache():
+    if SPELLING_CACHE.hits or SPELLING_CACHE.misses:
+        logging.info("Spelling cache: %d hits, %d misses", SPELLING_CACHE.hits, SPELLING_CACHE.misses)
+    SPELLING_CACHE.save()
+
+
 class SpellcheckNorm(object):
     """
     A class acting as a factory of functions performing string's spell check.
     """
     def __init__(self, dict_name, *wordlists):
-        if not enchant.dict_exists(dict_name):
-            raise ValueError("A dictionary ")
-        self.spellcheck_dict = enchant.Dict(dict_name)
-        for word in itertools.chain(*wordlists):
+        with timed("enchant dictionary " + dict_name):
+            import enchant
+            if not enchant.dict_exists(dict_name):
+                raise ValueError("A dictionary ")
+            self.spellcheck_dict = enchant.Dict(dict_name)
+        words = list(itertools.chain(*wordlists))
+        for word in words:
             self.spellcheck_dict.add_to_session(word)
+        self._cache_namespace = SPELLING_CACHE.namespace(dict_name, words)
         self._wds = re.compile(r'\b([\w-]+)\b', flags=re.U | re.I)
 
+    @instrumentation.measured("spellcheck")
     def __call__(self, text):
 
         def spellckeck_required(wd):
@@ -161,11 +459,13 @@ class SpellcheckNorm(object):
             return False
 
         def spellcheckme(match):
-            if self.spellcheck_dict.is_added(match.group(1)) or self.spellcheck_dict.check(match.group(1)):
+            word = match.group(1)
+            if self.spellcheck_dict.is_added(word) or SPELLING_CACHE.check(
+                    self._cache_namespace, self.spellcheck_dict, word):
                 return match.group(1)
             if not spellckeck_required(match.group(1)):
                 return match.group(1)
-            suggestions = self.spellcheck_dict.suggest(match.group(1))
+            suggestions = SPELLING_CACHE.suggest(self._cache_namespace, self.spellcheck_dict, word)
             return match.group(1) if not suggestions or match.group(1) in suggestions else suggestions[0]
 
         return self._wds.sub(spellcheckme, text)
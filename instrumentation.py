@@ -0,0 +1,261 @@
+"""
+Timers and counters of processing stages (Mystem, spellcheck, negation chunking, keyword search, postprocessing rules).
+
+Instrumentation is off by default and costs a flag check per stage then. Scripts turn it on with `--stats`
+(see `add_arguments` and `configure`): at exit, time spent per stage, counters and the slowest answers are printed
+to stderr and, with `--stats-json PATH`, saved as JSON.
+
+Time of a stage is reported both in total and excluding nested stages (e.g. Mystem calls made while chunking),
+so the exclusive times add up to the time spent in all the stages.
+
+Stages currently running in each thread are also available to a profiler (see `running_stages` and profiling.py).
+"""
+
+import atexit
+import functools
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Union
+
+FLAG = "--stats"
+
+enabled = False
+
+# Stage -> [calls, seconds, seconds excluding nested stages].
+_stages = OrderedDict()
+_counters = OrderedDict()
+# An answer text -> seconds spent on it.
+_answers = {}
+_lock = threading.Lock()
+_local = threading.local()
+# A thread id -> timers of stages running in the thread, from the outermost one.
+_stacks = {}
+# If True, timers remember frames they're started in (see running_stages).
+_track_frames = False
+_started = time.perf_counter()
+_path = None
+_slowest = 10
+
+
+class _Timer(object):
+    __slots__ = ("stage", "start", "nested", "frame")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.frame = None
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = _stacks[threading.get_ident()] = []
+        if _track_frames:
+            self.frame = sys._getframe(1)
+        stack.append(self)
+        self.nested = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        self.frame = None
+        if stack:
+            stack[-1].nested += elapsed
+        with _lock:
+            entry = _stages.get(self.stage)
+            if entry is None:
+                entry = _stages[self.stage] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - self.nested
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage: str):
+    """
+    Measure time spent on a stage (does nothing unless instrumentation is enabled).
+
+    :param stage: A name of a stage to report the time under.
+
+    :return: A context manager.
+    """
+    return _Timer(stage) if enabled else _NULL_TIMER
+
+
+def measured(stage: str):
+    """
+    A decorator measuring time spent in a function as a stage (see `timed`).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(counter: str, number: int = 1):
+    """
+    Increase a counter (does nothing unless instrumentation is enabled).
+    """
+    if enabled:
+        with _lock:
+            _counters[counter] = _counters.get(counter, 0) + number
+
+
+def add_answer_time(text: str, seconds: float):
+    """
+    Attribute time to an answer (to find the slowest ones).
+    """
+    if enabled:
+        with _lock:
+            _answers[text] = _answers.get(text, 0.0) + seconds
+
+
+class _AnswerTimer(object):
+    __slots__ = ("text", "start")
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_answer_time(self.text, time.perf_counter() - self.start)
+
+
+def answer(text: str):
+    """
+    Measure time spent on an answer (does nothing unless instrumentation is enabled).
+
+    :param text: A text of the answer to report the time under.
+
+    :return: A context manager.
+    """
+    return _AnswerTimer(text) if enabled else _NULL_TIMER
+
+
+def running_stages(thread_id: int) -> list:
+    """
+    Get stages running in a thread (only frames of stages started after `enable(track_frames=True)` are known).
+
+    :return: A list of pairs (a frame a stage is started in, a stage), from the outermost stage.
+    """
+    return [(timer.frame, timer.stage) for timer in list(_stacks.get(thread_id, ()))]
+
+
+def report() -> OrderedDict:
+    """
+    :return: Collected data: a wall time, stages (calls, seconds, self seconds), counters and the slowest answers.
+    """
+    with _lock:
+        stages = OrderedDict(
+            (stage, OrderedDict([("calls", calls), ("seconds", round(seconds, 6)),
+                                 ("self_seconds", round(self_seconds, 6))]))
+            for stage, (calls, seconds, self_seconds) in sorted(_stages.items(), key=lambda a: -a[1][2])
+        )
+        slowest = heapq.nlargest(_slowest, _answers.items(), key=lambda a: a[1])
+        return OrderedDict([
+            ("wall_seconds", round(time.perf_counter() - _started, 6)),
+            ("stages", stages),
+            ("counters", OrderedDict(sorted(_counters.items()))),
+            ("answers", len(_answers)),
+            ("slowest_answers", [OrderedDict([("text", text), ("seconds", round(seconds, 6))])
+                                 for text, seconds in slowest]),
+        ])
+
+
+def summary(data: dict, file=sys.stderr):
+    """
+    Print collected data in a human-readable form.
+    """
+    print("Stage statistics (wall time: {:.3f} s):".format(data["wall_seconds"]), file=file)
+    print("  {:<50} {:>9} {:>10} {:>10}".format("stage", "calls", "total, s", "self, s"), file=file)
+    for stage, values in data["stages"].items():
+        print("  {:<50} {:>9} {:>10.3f} {:>10.3f}".format(
+            stage[:50], values["calls"], values["seconds"], values["self_seconds"]), file=file)
+    if data["counters"]:
+        print("Counters:", file=file)
+        for counter, value in data["counters"].items():
+            print("  {:<50} {:>9}".format(counter[:50], value), file=file)
+    if data["slowest_answers"]:
+        print("Slowest answers (of {}):".format(data["answers"]), file=file)
+        for entry in data["slowest_answers"]:
+            print("  {:>8.4f} s  {}".format(entry["seconds"], entry["text"][:100].replace("\n", " ")), file=file)
+
+
+def _report_at_exit():
+    data = report()
+    summary(data)
+    if _path is not None:
+        with open(_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+_reporting = False
+
+
+def enable(path: Union[str, None] = None, slowest: int = 10, report_at_exit=True, track_frames=False):
+    """
+    Start collecting statistics.
+
+    :param path: A path to save the report (JSON) to; if None, only a summary is printed to stderr.
+    :param slowest: A number of the slowest answers to report.
+    :param report_at_exit: If True, the statistics are reported at exit.
+    :param track_frames: If True, frames stages are started in are kept for a profiler.
+    """
+    global enabled, _path, _slowest, _started, _reporting, _track_frames
+    if not enabled:
+        _started = time.perf_counter()
+    if report_at_exit and not _reporting:
+        atexit.register(_report_at_exit)
+        _reporting = True
+        _path, _slowest = path, slowest
+    enabled = True
+    _track_frames = _track_frames or track_frames
+
+
+def add_arguments(parser):
+    """
+    Add options turning instrumentation on to a parser of a script.
+    """
+    parser.add_argument(FLAG, action="store_true",
+                        help="print time spent per processing stage, counters and the slowest answers at exit")
+    parser.add_argument("--stats-json", type=str, metavar="PATH",
+                        help="save the statistics as JSON to a file (implies --stats)")
+    parser.add_argument("--stats-slowest", type=int, default=10, metavar="NUM",
+                        help="a number of the slowest answers to report with --stats")
+
+
+def configure(parsed):
+    """
+    Enable instrumentation if it's requested by the options parsed (see `add_arguments`).
+    """
+    if parsed.stats or parsed.stats_json is not None:
+        assert parsed.stats_slowest >= 0
+        path = None if parsed.stats_json is None else os.path.expanduser(os.path.abspath(parsed.stats_json))
+        enable(path, parsed.stats_slowest)
@@ -1,25 +1,24 @@
 #!/usr/local/bin/python3
 
 import argparse
-import csv
 import os
 import logging
 import re
 import sys
-from collections import Counter
 
-import nltk
-from nltk.collocations import *
-from nltk.text import TextCollection
-from pymystem3 import Mystem
-
-from generalling import pos
+# Imported before the other modules of the package to time their imports (see --profile-startup).
+import startup_profile
+import analysis_cache
+import instrumentation
+import profiling
+from columnar import is_columnar
+from generalling import GLOBAL_MYSTEM, POS_TABLE, pos
+from ngram_stats import NgramStatistics
+from readers import iter_cells
 
 logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s', level=logging.INFO, stream=sys.stderr)
 
 
-GLOBAL_MYSTEM = Mystem()
-
 START_PHRASE = [
     "мало",
     "много",
@@ -49,7 +48,11 @@ def convert_to_working_text(token_list):
     return token_list
 
 
-def generate_idf_keywords(texts, stopword_src=None, freq_threshold=0, avail_pos=None):
+def is_nonalpha(token):
+    return re.search(r'^[\W]+$', token) is not None
+
+
+def generate_idf_keywords(stats, stopword_src=None, freq_threshold=0, avail_pos=None):
     def appropriate_pos(tag):
         if avail_pos is None:
             return True
@@ -61,32 +64,32 @@ def generate_idf_keywords(texts, stopword_src=None, freq_threshold=0, avail_pos=
     else:
         with open(stopword_src) as f:
             stop_words = {i.strip() for i in f}
-    text_collection = TextCollection(texts)
 
     # Frequency distribution should include tokens including any letters only.
-    fd = Counter((i for i in text_collection.tokens if not re.search(r'^[\W]+$', i) and i not in stop_words))
+    idf = stats.idf()
+    candidates = [
+        (num, word) for num, word in enumerate(stats.words) if not is_nonalpha(word) and word not in stop_words
+    ]
+    candidates.sort(key=lambda a: idf[a[0]])
 
     ms = GLOBAL_MYSTEM
 
-    for i in sorted(fd.keys(), key=lambda a: text_collection.idf(a)):
-        if fd[i] > freq_threshold and appropriate_pos(pos(i, ms)) and len(i) > 1:
-            yield i, fd[i]
+    for num, i in candidates:
+        frequency = int(stats.unigram_counts[num])
+        if frequency > freq_threshold and appropriate_pos(pos(i, ms)) and len(i) > 1:
+            yield i, frequency
 
 
 def csv_to_lemmas(fn, column_number, skip_nonalpha=False, pattern=lambda a: a):
     texts = []
     ms = GLOBAL_MYSTEM
-    with open(fn) as f:
-        reader = csv.reader(f, delimiter=",")
-        for line in reader:
-            if column_number >= len(line):
-                continue
-            value = line[column_number]
+    for value in iter_cells(fn, column_number):
+        with instrumentation.answer(value), instrumentation.timed("lemmatization"):
             lemmas = pattern([i.strip() for i in ms.lemmatize(value) if i.strip()])
-            logging.info("Lemmatization: %s -> %s", value, " ".join(lemmas))
-            if skip_nonalpha:
-                lemmas = list(filter(lambda i: not re.search(r'^[\W]+$', i), lemmas))
-            texts.append(lemmas)
+        logging.info("Lemmatization: %s -> %s", value, " ".join(lemmas))
+        if skip_nonalpha:
+            lemmas = [i for i in lemmas if not is_nonalpha(i)]
+        texts.append(lemmas)
     if not texts:
         print("No lines containing column No.{} found.".format(column_number), file=sys.stderr)
     return texts
@@ -99,9 +102,8 @@ def several_columns_to_lemmas(fn, column_numbers, skip_nonalpha=False, pattern=l
     return texts
 
 
-def get_keywords(csv_path, stopword_path, col_num, threshold, line_preparation):
-    texts = several_columns_to_lemmas(csv_path, col_num, False, line_preparation)
-    return (i for i, j in generate_idf_keywords(texts, stopword_path, threshold, {"S"}))
+def get_keywords(stats, stopword_path, threshold):
+    return (i for i, j in generate_idf_keywords(stats, stopword_path, threshold, {"S"}))
 
 
 def bigram_filter_factory(stop_word_src, one_word_dic):
@@ -127,11 +129,8 @@ def bigram_filter_factory(stop_word_src, one_word_dic):
     return bigram_filter
 
 
-def get_bigrams(csv_path, col_num, filtering_condition, line_preparation):
-    lemmatized_texts = several_columns_to_lemmas(csv_path, col_num, True, line_preparation)
-    bigram_measures = nltk.collocations.BigramAssocMeasures()
-    finder = BigramCollocationFinder.from_documents(lemmatized_texts)
-    for ngram in finder.nbest(bigram_measures.poisson_stirling, 300):
+def get_bigrams(stats, filtering_condition):
+    for ngram in stats.nbest(*stats.bigram_scores(), 300):
         if filtering_condition(ngram):
             yield ngram
 
@@ -141,34 +140,45 @@ def filter_trigrams(trigram):
     return cond(pos(trigram[0], GLOBAL_MYSTEM)) and cond(pos(trigram[2], GLOBAL_MYSTEM))
 
 
-def get_trigrams(csv_path, col_num, filtering_condition, line_preparation):
-    trigram_measures = nltk.collocations.TrigramAssocMeasures()
-    finder = TrigramCollocationFinder.from_documents(several_columns_to_lemmas(csv_path, col_num, True, line_preparation))
-    for ngr in finder.nbest(trigram_measures.poisson_stirling, 300):
+def get_trigrams(stats, filtering_condition):
+    for ngr in stats.nbest(*stats.trigram_scores(), 300):
         if filtering_condition(ngr):
             yield ngr
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("csv", type=str, metavar="PATH", help="A path to a csv table to process.")
+    parser.add_argument("csv", type=str, metavar="PATH",
+                        help="A path to a csv table (or a columnar table directory, see columnar.py) to process.")
     parser.add_argument("column", type=int, metavar="NUM", nargs="+", help="A number of column to process.")
     parser.add_argument("-n", "--ngram", type=int, metavar="WORD_NUM", default=1,
-                        help="A number of words in an ngram (0 < n < 4).")
+                        help="A number of words in an ngram (0 < n < 4); 0 means all of them at once.")
     parser.add_argument("-s", "--stop_words", type=str, metavar="PATH",
                         help="A path to a file containing stop words (one per line).")
     parser.add_argument("-c", "--cut_lines_by_template", action="store_true",
                         help="Choose whether a content of a table should be cut.")
+    parser.add_argument("--cache", type=str, metavar="PATH",
+                        help="A path to a file to cache Mystem analyses in.")
+    parser.add_argument("--pos-table", type=str, metavar="PATH",
+                        help="A path to a file to keep parts of speech of words in between runs.")
+    parser.add_argument(startup_profile.FLAG, action="store_true",
+                        help="Print time spent on imports and initialization of heavy resources at exit.")
+    instrumentation.add_arguments(parser)
+    profiling.add_arguments(parser)
 
     data = parser.parse_args()
     data.csv = os.path.expanduser(os.path.abspath(data.csv))
     data.column = [i - 1 for i in data.column]
     if data.stop_words is not None:
         data.stop_words = os.path.expanduser(os.path.abspath(data.stop_words))
-    if data.ngram > 3 or data.ngram < 1:
+    if data.cache is not None:
+        data.cache = os.path.expanduser(os.path.abspath(data.cache))
+    if data.pos_table is not None:
+        data.pos_table = os.path.expanduser(os.path.abspath(data.pos_table))
+    if data.ngram > 3 or data.ngram < 0:
         print("Incorrect ngram length: {}.".format(data.ngram), file=sys.stderr)
         raise ValueError()
-    if not os.path.isfile(data.csv):
+    if not os.path.isfile(data.csv) and not is_columnar(data.csv):
         print("File does not exist: {}".format(data.csv), file=sys.stderr)
         raise ValueError()
     if data.stop_words is not None:
@@ -189,20 +199,39 @@ if __name__ == "__main__":
         args = parse_args()
     except ValueError:
         sys.exit(1)
+    analysis_cache.configure(args.cache)
+    instrumentation.configure(args)
+    profiling.configure(args)
+    if args.pos_table is not None:
+        POS_TABLE.load(args.pos_table)
 
     func = convert_to_working_text if args.cut_lines_by_template else (lambda a: a)
 
-    if args.ngram == 1:
-        for i in get_keywords(args.csv, args.stop_words, args.column, THRESHOLD_ONE, func):
-            print(i)
-    elif args.ngram == 2:
-        one_word_dic = set(get_keywords(args.csv, args.stop_words, args.column, THRESHOLD_TWO, func))
-        if not one_word_dic:
-            print("No dic compiled. Exiting...", file=sys.stderr)
-            sys.exit()
-        bigram_filter = bigram_filter_factory(args.stop_words, one_word_dic)
-        for i in get_bigrams(args.csv, args.column, bigram_filter, func):
-            print(*i)
-    else:
-        for i in get_trigrams(args.csv, args.column, filter_trigrams, func):
-            print(*i)
+    # Texts are lemmatized once: all the statistics are calculated from the same lemmas.
+    texts = several_columns_to_lemmas(args.csv, args.column, False, func)
+    lengths = [1, 2, 3] if args.ngram == 0 else [args.ngram]
+    with instrumentation.timed("n-gram statistics"):
+        stats = NgramStatistics(texts)
+        if 2 in lengths or 3 in lengths:
+            alpha_stats = NgramStatistics([[i for i in text if not is_nonalpha(i)] for text in texts])
+    # All the words filtered by a part of speech below come from the vocabulary.
+    with instrumentation.timed("POS table warm-up"):
+        POS_TABLE.warm_up(stats.words, GLOBAL_MYSTEM)
+
+    if 1 in lengths:
+        with instrumentation.timed("keywords"):
+            for i in get_keywords(stats, args.stop_words, THRESHOLD_ONE):
+                print(i)
+    if 2 in lengths:
+        with instrumentation.timed("bigrams"):
+            one_word_dic = set(get_keywords(stats, args.stop_words, THRESHOLD_TWO))
+            if not one_word_dic:
+                print("No dic compiled. Skipping bigrams...", file=sys.stderr)
+            else:
+                bigram_filter = bigram_filter_factory(args.stop_words, one_word_dic)
+                for i in get_bigrams(alpha_stats, bigram_filter):
+                    print(*i)
+    if 3 in lengths:
+        with instrumentation.timed("trigrams"):
+            for i in get_trigrams(alpha_stats, filter_trigrams):
+                print(*i)
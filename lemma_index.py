@@ -0,0 +1,328 @@
+#!/usr/local/bin/python3
+"""
+An inverted index of lemmas of survey answers.
+
+Answers are read as the tagger reads them (see `readers.iter_columns`), so duplicate lines are skipped the same way.
+Each token of lemmatized answers (as the tagger's matcher sees them, see `tagging_state.lemmas_text` and
+`matching.text_tokens`) is mapped to its postings: pairs (cell, position of the token in the cell) stored
+as delta-encoded varints. Words and punctuation are indexed, while single spaces between words are not:
+a position no token is found at is a space. So a plain keyword is found in the cells containing all its tokens
+at consecutive positions, which is what the tagger's matcher does, and texts of cells are restored from postings
+when a regex keyword is looked up. The results are the same as the ones of `tagging_by_keywords.py`.
+"""
+
+import argparse
+import array
+import csv
+import os
+import pickle
+import re
+import sys
+
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import analysis_cache
+import instrumentation
+import profiling
+from answer import Answer, iter_answers
+from columnar import is_columnar
+from matching import KeywordMatcher, keyword_words, text_tokens
+from readers import DuplicateFilter, iter_columns
+from tagging_state import lemmas_text
+
+INDEX_VERSION = 2
+
+# Spaces between words aren't indexed, the other separators are also indexed under this term.
+_SPACE = " "
+_SEPARATORS = ""
+_WORD = re.compile(r"\w")
+
+
+def encode_varints(numbers: Iterable[int]) -> bytes:
+    """
+    Encode non-negative integers as varints (7 bits per byte, the highest bit marks continuation).
+    """
+    data = bytearray()
+    for number in numbers:
+        while number >= 0x80:
+            data.append(number & 0x7f | 0x80)
+            number >>= 7
+        data.append(number)
+    return bytes(data)
+
+
+def decode_varints(data: bytes) -> List[int]:
+    numbers = []
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(number)
+            number = shift = 0
+    return numbers
+
+
+def _encode_postings(postings: List[Tuple[int, int]]) -> bytes:
+    # Cells are delta-encoded; positions are delta-encoded within a cell.
+    deltas = []
+    last_cell = last_position = 0
+    for cell, position in postings:
+        if cell != last_cell:
+            deltas.extend((cell - last_cell, position))
+        else:
+            deltas.extend((0, position - last_position))
+        last_cell, last_position = cell, position
+    return encode_varints(deltas)
+
+
+def _decode_postings(data: bytes) -> List[Tuple[int, int]]:
+    deltas = decode_varints(data)
+    postings = []
+    cell = position = 0
+    for num in range(0, len(deltas), 2):
+        if deltas[num]:
+            cell += deltas[num]
+            position = deltas[num + 1]
+        else:
+            position += deltas[num + 1]
+        postings.append((cell, position))
+    return postings
+
+
+class LemmaIndex(object):
+    """
+    An index of cells of a table: postings of tokens of their lemmatized texts.
+    """
+
+    def __init__(self, source: str, rows: array.array, vocabulary: Dict[str, Tuple[int, int]], postings: bytes):
+        """
+        :param source: A path to an indexed table.
+        :param rows: Numbers of rows of cells (as in a table file, the header is row 1).
+        :param vocabulary: Tokens with a start and an end of their postings in the postings blob.
+        :param postings: Encoded postings of all the tokens.
+        """
+        self.source = source
+        self.rows = rows
+        self.vocabulary = vocabulary
+        self.postings = postings
+        self._separators = None
+        self._texts = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, path: str, columns: List[int], batch_size=0,
+              duplicates: Union[DuplicateFilter, None] = None) -> "LemmaIndex":
+        """
+        Lemmatize cells of a table and index them.
+
+        :param path: A path to a table or a columnar table directory.
+        :param columns: Numbers of columns to index (starting from 1).
+        :param batch_size: A number of answers to send to Mystem at once (0 means analyzing them one by one).
+        :param duplicates: A filter to skip repeated lines with (see readers.iter_columns).
+        """
+        rows = array.array("I")
+
+        def iter_cells() -> Iterator[Tuple[int, str]]:
+            for row, text in iter_columns(path, *columns, duplicates=duplicates):
+                rows.append(row)
+                yield row, text
+
+        token_postings = {}
+        if batch_size > 0:
+            answers = iter_answers(iter_cells(), batch_size)
+        else:
+            answers = (Answer(text, row) for row, text in iter_cells())
+        for cell, answer_instance in enumerate(answers):
+            for position, token in enumerate(text_tokens(lemmas_text(answer_instance))):
+                if token == _SPACE:
+                    continue
+                token_postings.setdefault(token, []).append((cell, position))
+                if not _WORD.match(token):
+                    token_postings.setdefault(_SEPARATORS, []).append((cell, position))
+
+        vocabulary, blob = {}, bytearray()
+        for token in sorted(token_postings):
+            encoded = _encode_postings(token_postings[token])
+            vocabulary[token] = (len(blob), len(blob) + len(encoded))
+            blob.extend(encoded)
+        return cls(os.path.abspath(path), rows, vocabulary, bytes(blob))
+
+    @classmethod
+    def load(cls, path: str) -> "LemmaIndex":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.pop("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version: {}".format(path))
+        return cls(**data)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(dict(
+                source=self.source, rows=self.rows, vocabulary=self.vocabulary, postings=self.postings,
+                version=INDEX_VERSION
+            ), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def token_postings(self, token: str) -> List[Tuple[int, int]]:
+        """
+        Get pairs (cell, position) of a token (spaces aren't indexed).
+        """
+        if token not in self.vocabulary:
+            return []
+        start, end = self.vocabulary[token]
+        return _decode_postings(self.postings[start:end])
+
+    def _phrase_cells(self, tokens: List[str]) -> List[int]:
+        """
+        Get cells containing tokens at consecutive positions.
+        """
+        starts = None
+        for shift, token in enumerate(tokens):
+            if token == _SPACE:
+                continue
+            positions = {(cell, position - shift) for cell, position in self.token_postings(token)}
+            starts = positions if starts is None else starts & positions
+            if not starts:
+                return []
+        spaces = [shift for shift, token in enumerate(tokens) if token == _SPACE]
+        if spaces:
+            # A space is between two words, so it's a position no other separator is found at.
+            if self._separators is None:
+                self._separators = set(self.token_postings(_SEPARATORS))
+            starts = {
+                (cell, start) for cell, start in starts
+                if all((cell, start + shift) not in self._separators for shift in spaces)
+            }
+        return sorted({cell for cell, _ in starts})
+
+    def text(self, num: int) -> str:
+        """
+        Get a lemmatized text of a cell restored from postings.
+        """
+        if self._texts is None:
+            cell_tokens = [{} for _ in range(len(self))]
+            for token in self.vocabulary:
+                if token != _SEPARATORS:
+                    for cell, position in self.token_postings(token):
+                        cell_tokens[cell][position] = token
+            self._texts = [
+                "".join(tokens.get(i, _SPACE) for i in range(max(tokens, default=-1) + 1)) for tokens in cell_tokens
+            ]
+        return self._texts[num]
+
+    def search(self, keyword: str) -> List[int]:
+        """
+        Find cells a keyword is found in by the tagger (see `matching.KeywordMatcher`).
+
+        :param keyword: A keyword (a phrase or a regex).
+
+        :return: A sorted list of numbers of cells.
+        """
+        if keyword_words(keyword) is not None:
+            return self._phrase_cells(text_tokens(keyword))
+        matcher = KeywordMatcher([keyword])
+        return [cell for cell in range(len(self)) if matcher.search(self.text(cell))]
+
+
+def iter_dictionary(fn: str) -> Iterator[Tuple[int, str, List[str]]]:
+    """
+    Read a tagging dictionary (each line is a tag followed by its keywords).
+
+    :return: An iterator over triples (line number, tag, keywords).
+    """
+    with open(fn) as f:
+        for num, line in enumerate(csv.reader(f, delimiter=","), 1):
+            if line:
+                hl, *kws = line
+                yield num, hl, [kw for kw in kws if kw]
+
+
+def report(index: LemmaIndex, dictionary: str, file=sys.stdout):
+    """
+    Print rows each line of a dictionary hits: a line number, a tag, a number of rows, hits per keyword and the rows.
+    """
+    writer = csv.writer(file, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(["line", "tag", "rows", "keywords", "row numbers"])
+    for num, tag, keywords in iter_dictionary(dictionary):
+        rows, counts = set(), []
+        for keyword in keywords:
+            keyword_rows = {index.rows[cell] for cell in index.search(keyword)}
+            rows.update(keyword_rows)
+            counts.append("{} ({})".format(keyword, len(keyword_rows)))
+        writer.writerow([num, tag, len(rows), ", ".join(counts), " ".join(str(i) for i in sorted(rows))])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="A script looking up keywords in lemmatized answers of a survey.")
+    instrumentation.add_arguments(parser)
+    profiling.add_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    build = subparsers.add_parser("build", help="lemmatize answers of a table and index them")
+    build.add_argument("csv", type=str, metavar="PATH",
+                       help="a path to a table (or a columnar table directory, see columnar.py)")
+    build.add_argument("index", type=str, metavar="PATH", help="a path to save the index to")
+    build.add_argument("-c", "--columns", type=int, nargs="+", required=True, metavar="NUM",
+                       help="numbers of columns to index (starting from 1); a text repeated in a line is indexed once")
+    build.add_argument("-b", "--batch-size", type=int, default=0, metavar="NUM",
+                       help="a number of answers to send to Mystem at once, one per line (by default answers "
+                            "are analyzed one by one); the analyses are the same")
+    build.add_argument("--duplicates", type=str, choices=DuplicateFilter.MODES, default="memory",
+                       help="how to keep track of lines seen to skip duplicates (see tagging_by_keywords.py)")
+    build.add_argument("--key-columns", type=int, nargs="+", metavar="NUM",
+                       help="numbers of columns to compare lines by when looking for duplicates "
+                            "(all but the first by default)")
+    build.add_argument("--cache", type=str, metavar="PATH",
+                       help="a path to a file to cache Mystem analyses in (see analysis_cache.py)")
+
+    query = subparsers.add_parser("query", help="print answers containing keywords")
+    query.add_argument("index", type=str, metavar="PATH", help="a path to an index")
+    query.add_argument("keywords", type=str, nargs="+", metavar="KEYWORD",
+                       help="lemmatized keywords as they're written in a dictionary")
+
+    dic_report = subparsers.add_parser("report", help="print rows each line of a dictionary hits")
+    dic_report.add_argument("index", type=str, metavar="PATH", help="a path to an index")
+    dic_report.add_argument("dic", type=str, metavar="PATH", help="a path to a tagging dictionary")
+
+    parsed = parser.parse_args()
+    parsed.index = os.path.expanduser(os.path.abspath(parsed.index))
+    if parsed.command == "build":
+        parsed.csv = os.path.expanduser(os.path.abspath(parsed.csv))
+        if parsed.cache is not None:
+            parsed.cache = os.path.expanduser(os.path.abspath(parsed.cache))
+        assert os.path.isfile(parsed.csv) or is_columnar(parsed.csv)
+        assert all(i > 0 for i in parsed.columns)
+        assert parsed.batch_size >= 0
+    else:
+        assert os.path.isfile(parsed.index)
+    if parsed.command == "report":
+        parsed.dic = os.path.expanduser(os.path.abspath(parsed.dic))
+        assert os.path.isfile(parsed.dic)
+    return parsed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    instrumentation.configure(args)
+    profiling.configure(args)
+    if args.command == "build":
+        analysis_cache.configure(args.cache)
+        lemma_index = LemmaIndex.build(
+            args.csv, args.columns, args.batch_size, DuplicateFilter(args.key_columns, args.duplicates)
+        )
+        lemma_index.save(args.index)
+        print("Cells indexed: {}, tokens: {}".format(len(lemma_index), len(lemma_index.vocabulary)), file=sys.stderr)
+    elif args.command == "query":
+        lemma_index = LemmaIndex.load(args.index)
+        writer = csv.writer(sys.stdout, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+        for kw in args.keywords:
+            found = lemma_index.search(kw)
+            for cell_num in found:
+                writer.writerow([kw, lemma_index.rows[cell_num], lemma_index.text(cell_num)])
+            print("{}: {} answers".format(kw, len(found)), file=sys.stderr)
+    else:
+        report(LemmaIndex.load(args.index), args.dic)
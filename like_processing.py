@@ -2,21 +2,28 @@
 
 import argparse
 import csv
-import itertools
 import json
 import logging
-import nltk
 import os
-import re
 import sys
 
 
-from collections import namedtuple, OrderedDict
-from typing import Dict, Union, List
+from collections import Counter, namedtuple, OrderedDict
+from typing import Dict, Union, List, Tuple
 
+# Imported before the other modules of the package to time their imports (see --profile-startup).
+import startup_profile
+import analysis_cache
+import instrumentation
+import profiling
+import mystem_pool
 from answer import SimpleAnswer, FullSpellcheckAnswer
-from generalling import NegationParser
+from columnar import is_columnar
+from generalling import NegationParser, SPELLING_CACHE
+from matching import KeywordMatcher
+from pipeline import ordered_map
 from readers import read_wordlists, read_csv_dictionaries, read_columns
+from sentence_splitter import SPLITTER
 
 
 logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s', level=logging.INFO, stream=sys.stderr)
@@ -56,18 +63,11 @@ class Searcher(object):
     sorted by priorities specified by an input ordered dict.
     """
     def __init__(self, dictionary: OrderedDict):
-        self._regexes = {
-            word: re.compile(r"\b({})\b".format(word), flags=re.I) for word in dictionary.keys()
-            }
-        self._order = {word: number for number, word in enumerate(dictionary.keys())}
+        self._matcher = KeywordMatcher(dictionary.keys())
 
+    @instrumentation.measured("keyword search")
     def search(self, text: str) -> List[str]:
-        indices = []
-        for word, regex in self._regexes.items():
-            for match in regex.finditer(text):
-                indices.append((word, self._order[word], match.start(1)))
-        indices.sort(key=lambda a: (a[1], a[2]))
-        return [word for word, _, _ in indices]
+        return [word for word, _, _ in self._matcher.find_all(text)]
 
 
 class _MatchToPredefinedAnswer(object):
@@ -77,8 +77,9 @@ class _MatchToPredefinedAnswer(object):
 
     def _update_searcher(self, dictionary: OrderedDict):
         if dictionary is not self.__dict_cache:
-            self.__dict_cache = dictionary
+            # The searcher is set first, since answers may be processed by several threads.
             self.searcher = Searcher(dictionary)
+            self.__dict_cache = dictionary
 
     def __call__(self,
                  answer: str,
@@ -116,10 +117,9 @@ class _MatchToPredefinedAnswer(object):
 class TextAnswerProcessor(object):
 
     @staticmethod
+    @instrumentation.measured("sentence splitting")
     def to_sentences(text):
-        standard_sent = nltk.sent_tokenize(text)
-        return list(
-            filter(lambda a: a, itertools.chain(*[map(lambda a: a.strip(), i.split(";")) for i in standard_sent])))
+        return list(SPLITTER(text))
 
     @staticmethod
     def to_priority_answer(answer: str,
@@ -162,24 +162,103 @@ class TextAnswerProcessor(object):
         return False
 
 
+class _Rows(list):
+    """
+    Output rows of an answer kept until the preceding answers are written (has the interface of `csv.writer`).
+    """
+    writerow = list.append
+
+
+class Paths(object):
+    """
+    Paths an answer may take through processing (see process_answer).
+    """
+    STOPPED = "stopped directly"
+    DIRECT = "matched directly"
+    NO_SPELLCHECK = "matched without spellcheck"
+    FULL_SPELLCHECK = "matched with full spellcheck"
+    SPELLCHECK_SKIPPED = "unprocessed, spellcheck skipped"
+    UNPROCESSED = "unprocessed after spellcheck"
+
+    unprocessed = (SPELLCHECK_SKIPPED, UNPROCESSED)
+
+
+def process_answer(item: Tuple[int, str], syn_matcher, ready_answers: dict, stop_after) -> tuple:
+    """
+    Match an answer to the predefined ones: without spellcheck first, then with full spellcheck.
+
+    Spellcheck is skipped if no part of the answer analyzed in the first pass has words unknown to Mystem,
+    since it can't change lemmas of such an answer.
+
+    :param item: A pair (line number, answer).
+
+    :returns: A tuple (answer, output rows, a path the answer took, see Paths).
+    """
+    num, ans = item
+    logging.info("Start processing answer: '{}' (line {})".format(ans, num))
+    if ans in stop_after:
+        logging.info("Processing path (aborting directly): {}".format(ans))
+        return ans, [], Paths.STOPPED
+    direct_match = ready_answers.get(ans.lower()) or ready_answers.get(ans)
+    if direct_match:
+        logging.info("Processing path (matched directly): {} -> {}".format(ans, direct_match))
+        return ans, [[ans, direct_match]], Paths.DIRECT
+
+    rows, analyzed = _Rows(), []
+
+    def simple_answer(text, include_punctuation, analysis=None):
+        answer_instance = SimpleAnswer(text, include_punctuation, analysis)
+        analyzed.append(answer_instance)
+        return answer_instance
+
+    logging.info("Try processing with %s, chunk: %s", "no spellcheck", "no spellcheck")
+    if TextAnswerProcessor.to_priority_answer(ans, simple_answer, syn_matcher, ready_answers, stop_after, rows):
+        return ans, rows, Paths.NO_SPELLCHECK
+    if not any(i.needs_spellcheck for i in analyzed):
+        logging.info("Processing path (aborting, no words to spellcheck): {}".format(ans))
+        return ans, rows, Paths.SPELLCHECK_SKIPPED
+    logging.info("Try processing with %s, chunk: %s", "full spellcheck", "full spellcheck")
+    if TextAnswerProcessor.to_priority_answer(ans, FullSpellcheckAnswer, syn_matcher, ready_answers, stop_after, rows):
+        return ans, rows, Paths.FULL_SPELLCHECK
+    logging.info("Processing path (aborting): {}".format(ans))
+    return ans, rows, Paths.UNPROCESSED
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="A script producing statistics on respondents' likes and dislikes.")
     parser.add_argument("like", metavar="STR", type=str, choices=["like", "dislike"], help="'like' or 'dislike'")
-    parser.add_argument("data_table", metavar="PATH", type=str, help="path to a csv table containing the data")
+    parser.add_argument("data_table", metavar="PATH", type=str,
+                        help="path to a csv table (or a columnar table directory) containing the data")
     parser.add_argument("dictionaries", metavar="PATH", type=str, help="path to specific dictionaries")
 
     parser.add_argument("-u", "--unprocessed", metavar="PATH", type=str,
                         help="path to a file to write unprocessed answers to")
+    parser.add_argument("--cache", metavar="PATH", type=str,
+                        help="path to a file to cache Mystem analyses in")
+    parser.add_argument("--spelling-cache", metavar="PATH", type=str,
+                        help="path to a file to keep spellchecker results in between runs")
+    parser.add_argument("-t", "--threads", metavar="NUM", type=int, default=1,
+                        help="a number of answers to process at once, each thread using its own Mystem process "
+                             "(the output order doesn't depend on it)")
+    parser.add_argument(startup_profile.FLAG, action="store_true",
+                        help="print time spent on imports and initialization of heavy resources at exit")
+    instrumentation.add_arguments(parser)
+    profiling.add_arguments(parser)
 
     parsed = parser.parse_args()
     parsed.data_table = os.path.expanduser(os.path.abspath(parsed.data_table))
     parsed.dictionaries = os.path.expanduser(os.path.abspath(parsed.dictionaries))
-    assert os.path.isfile(parsed.data_table)
+    assert os.path.isfile(parsed.data_table) or is_columnar(parsed.data_table)
     assert os.path.isdir(parsed.dictionaries)
+    assert parsed.threads > 0
     if parsed.unprocessed:
         parsed.unprocessed = os.path.expanduser(os.path.abspath(parsed.unprocessed))
     else:
         parsed.unprocessed = os.devnull
+    if parsed.cache:
+        parsed.cache = os.path.expanduser(os.path.abspath(parsed.cache))
+    if parsed.spelling_cache:
+        parsed.spelling_cache = os.path.expanduser(os.path.abspath(parsed.spelling_cache))
     return parsed
 
 
@@ -209,6 +288,11 @@ def read_negs(filename):
 if __name__ == '__main__':
 
     parsed = parse_args()
+    analysis_cache.configure(parsed.cache)
+    instrumentation.configure(parsed)
+    profiling.configure(parsed)
+    if parsed.spelling_cache:
+        SPELLING_CACHE.load(parsed.spelling_cache)
     # Initializing dictionaries.
     dictionary_paths = get_dictionary_paths(parsed.dictionaries, parsed.like)
     if not dictionary_paths:
@@ -234,30 +318,27 @@ if __name__ == '__main__':
     match_to_predefined_answer = _MatchToPredefinedAnswer()
     synonym_matcher = lambda a, ac: match_to_predefined_answer(a, ac, syn_dic, negation_parser)
 
-    ANSWER_TYPES = [
-        ("no spellcheck", SimpleAnswer),
-        ("full spellcheck", FullSpellcheckAnswer),
-    ]
+    if parsed.threads > 1:
+        mystem_pool.configure(parsed.threads)
+    # The tokenizer model is loaded before answers are processed, so that the first ones don't wait for it.
+    SPLITTER.load()
 
     writer = csv.writer(sys.stdout, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
 
     with open(parsed.unprocessed, "w") as unproc_file:
-        for num, ans in read_columns(parsed.data_table, *colnums):
-
-            logging.info("Start processing answer: '{}' (line {})".format(ans, num))
-            if ans in stops:
-                logging.info("Processing path (aborting directly): {}".format(ans))
-                continue
-            direct_match = ready_answers.get(ans.lower()) or ready_answers.get(ans)
-            if direct_match:
-                logging.info("Processing path (matched directly): {} -> {}".format(ans, direct_match))
-                writer.writerow([ans, direct_match])
-                continue
-
-            for type_name, answer_type in ANSWER_TYPES:
-                logging.info("Try processing with %s, chunk: %s", type_name, type_name)
-                if TextAnswerProcessor.to_priority_answer(ans, answer_type, synonym_matcher, ready_answers, stops, writer):
-                    break
-            else:
+        def process(item):
+            with instrumentation.answer(item[1]):
+                return process_answer(item, synonym_matcher, ready_answers, stops)
+
+        results = ordered_map(process, read_columns(parsed.data_table, *colnums), parsed.threads)
+        path_counts = Counter()
+        for ans, rows, path in results:
+            writer.writerows(rows)
+            path_counts[path] += 1
+            instrumentation.count("answers " + path)
+            if path in Paths.unprocessed:
                 print(ans, file=unproc_file)
-                logging.info("Processing path (aborting): {}".format(ans))
+    logging.info("Processing paths: %s", ", ".join("{}: {}".format(path, path_counts[path]) for path in (
+        Paths.STOPPED, Paths.DIRECT, Paths.NO_SPELLCHECK, Paths.FULL_SPELLCHECK, Paths.SPELLCHECK_SKIPPED,
+        Paths.UNPROCESSED
+    )))
@@ -0,0 +1,120 @@
+"""
+A matcher looking for many keywords in a text in one pass.
+"""
+
+import re
+
+from typing import Iterable, List, Tuple, Union
+
+_TOKENS = re.compile(r"(\w+)|\W+")
+_PLAIN_KEYWORD = re.compile(r"\w+(?:[^\w.^$*+?{}\[\]\\|()]+\w+)*")
+
+
+def _tokenize(text: str) -> List[Tuple[str, int, bool]]:
+    """
+    Split a text into alternating runs of word and non-word characters.
+
+    :param text: A text to split.
+
+    :return: A list of triples (token, offset, the token is a word).
+    """
+    return [(m.group(0), m.start(), m.group(1) is not None) for m in _TOKENS.finditer(text)]
+
+
+def text_words(text: str) -> List[str]:
+    """
+    Get words of a text (lowercased) as the matcher sees them.
+    """
+    return [token for token, _, is_word in _tokenize(text.lower()) if is_word]
+
+
+def text_tokens(text: str) -> List[str]:
+    """
+    Get tokens of a text (lowercased) as the matcher sees them: words alternating with runs of other characters.
+    """
+    return [token for token, _, _ in _tokenize(text.lower())]
+
+
+def keyword_words(keyword: str) -> Union[List[str], None]:
+    """
+    Get words any text containing a keyword should contain.
+
+    :param keyword: A keyword.
+
+    :return: A list of lowercased words or None if the keyword is a regex, so any text can match it.
+    """
+    if not _PLAIN_KEYWORD.fullmatch(keyword):
+        return None
+    return text_words(keyword)
+
+
+class KeywordMatcher(object):
+    """
+    A class looking for keywords the same way `re.finditer(r"\\b({})\\b".format(keyword), text, flags=re.I)` does.
+
+    Keywords consisting of words separated by spaces or punctuation are put into a trie over tokens,
+    so all of them are found in one scan of a text. Keywords containing regex syntax are matched with regexes.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        """
+        :param keywords: Keywords in the order of priority.
+        """
+        self.keywords = list(keywords)
+        self._trie = {}
+        self._regexes = []
+        for num, keyword in enumerate(self.keywords):
+            if _PLAIN_KEYWORD.fullmatch(keyword):
+                node = self._trie
+                for token, _, _ in _tokenize(keyword.lower()):
+                    node = node.setdefault(token, {})
+                node.setdefault(None, []).append(num)
+            else:
+                self._regexes.append((num, re.compile(r"\b({})\b".format(keyword), flags=re.I)))
+
+    def find_all(self, text: str) -> List[Tuple[str, int, int]]:
+        """
+        Find all the keyword occurrences in a text.
+
+        :param text: A text to search in.
+
+        :return: A list of triples (keyword, priority, position) sorted by priority and position.
+        """
+        found = []
+        last_ends = {}
+        tokens = _tokenize(text.lower())
+        for start, (_, position, is_word) in enumerate(tokens):
+            if not is_word:
+                continue
+            node = self._trie
+            for num in range(start, len(tokens)):
+                token, offset, _ = tokens[num]
+                node = node.get(token)
+                if node is None:
+                    break
+                for kw_num in node.get(None, ()):
+                    # Matches of the same keyword don't overlap, as in re.finditer.
+                    if last_ends.get(kw_num, 0) <= position:
+                        found.append((self.keywords[kw_num], kw_num, position))
+                        last_ends[kw_num] = offset + len(token)
+        for num, regex in self._regexes:
+            for match in regex.finditer(text):
+                found.append((self.keywords[num], num, match.start(1)))
+        found.sort(key=lambda a: (a[1], a[2]))
+        return found
+
+    def search(self, text: str) -> List[str]:
+        """
+        Find keywords occurring in a text.
+
+        :param text: A text to search in.
+
+        :return: A list of keywords found (in the order of priority).
+        """
+        seen = set()
+        keywords = []
+        for keyword, num, _ in self.find_all(text):
+            if num not in seen:
+                seen.add(num)
+                keywords.append(keyword)
+        return keywords
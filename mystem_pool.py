@@ -0,0 +1,235 @@
+"""
+A pool of Mystem processes shared by all the modules of a process.
+
+Mystem instances are created on first use and handed out to one caller at a time,
+so threads can analyze texts concurrently up to the pool size.
+The size is taken from the MYSTEM_POOL_SIZE environment variable (1 by default) or set with `configure`.
+"""
+
+import atexit
+import codecs
+import contextlib
+import json
+import logging
+import os
+import re
+import select
+import threading
+
+from typing import List
+
+from pymystem3 import Mystem
+from pymystem3 import mystem as pymystem
+
+import instrumentation
+from startup_profile import timed
+
+DEFAULT_SIZE = int(os.environ.get("MYSTEM_POOL_SIZE", 1))
+
+# A number of the first lines sent at once compared with analyses of the lines sent one by one (see analyze_lines)
+# and a number of lines sent at once per a line compared later.
+CHECKED_LINES = 100
+CHECK_PERIOD = 1000
+# Seconds to wait for Mystem's output, as pymystem3 does.
+_TIMEOUT = 30
+_SPACES = re.compile(r"\s*")
+
+
+def _write_all(stream, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[stream.write(view):]
+    stream.flush()
+
+
+def request_lines(instance: Mystem, lines: List[str]) -> List[list]:
+    """
+    Send lines to a running Mystem process in one request and read their analyses.
+
+    It's the protocol of `Mystem.analyze` with all the lines written at once: Mystem answers each line of its input
+    with a JSON list. The lines are written from another thread, so Mystem never waits for its output to be read.
+
+    :param instance: A Mystem instance with a started process (see `Mystem.start`).
+    :param lines: Lines to analyze (without line breaks).
+
+    :return: A list of analyses (one per line).
+    """
+    writer = threading.Thread(
+        target=_write_all, args=(instance._procin, "".join(line + "\n" for line in lines).encode("utf-8")), daemon=True
+    )
+    writer.start()
+    decoder, text_decoder = json.JSONDecoder(), codecs.getincrementaldecoder("utf-8")()
+    analyses, output = [], ""
+    while len(analyses) < len(lines):
+        ready, _, _ = select.select([instance._procout_no], [], [], _TIMEOUT)
+        if not ready:
+            raise RuntimeError("Mystem hasn't answered {} of {} lines".format(len(lines) - len(analyses), len(lines)))
+        data = instance._procout.read()
+        if data is None:
+            continue
+        if not data:
+            raise RuntimeError("Mystem has exited")
+        output += text_decoder.decode(data)
+        position = 0
+        while True:
+            position = _SPACES.match(output, position).end()
+            try:
+                analysis, position = decoder.raw_decode(output, position)
+            except ValueError:
+                break
+            analyses.append(analysis)
+        output = output[position:]
+    writer.join()
+    if output.strip() or len(analyses) > len(lines):
+        raise RuntimeError("Mystem has answered more lines than sent")
+    return analyses
+
+
+
+class MystemPool(object):
+    """
+    A set of Mystem instances run with the same options, started lazily.
+    """
+
+    def __init__(self, size: int = DEFAULT_SIZE, **options):
+        """
+        :param size: A maximal number of Mystem processes to run.
+        :param options: Options to create Mystem instances with (see `Mystem.__init__`).
+        """
+        self.size = size
+        self._options = options
+        self._idle = []
+        self._instances = []
+        self._condition = threading.Condition()
+        self._lines_supported = pymystem._PIPELINE_MODE
+        self._checked_lines = self._unchecked_lines = 0
+
+    def _prototype(self) -> Mystem:
+        with self._condition:
+            if not self._instances:
+                instance = Mystem(**self._options)
+                self._instances.append(instance)
+                self._idle.append(instance)
+            return self._instances[0]
+
+    @property
+    def mystem_bin(self) -> str:
+        return self._prototype()._mystem_bin
+
+    @property
+    def mystem_args(self) -> List[str]:
+        return self._prototype()._mystemargs
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """
+        Get a Mystem instance for exclusive use, waiting for one to become free if all of them are busy.
+        """
+        with self._condition:
+            while not self._idle and len(self._instances) >= self.size:
+                self._condition.wait()
+            if self._idle:
+                instance = self._idle.pop()
+            else:
+                instance = Mystem(**self._options)
+                self._instances.append(instance)
+        if instance._proc is None:
+            with timed("Mystem process start"):
+                instance.start()
+        failed = True
+        try:
+            yield instance
+            failed = False
+        finally:
+            with self._condition:
+                if failed or len(self._instances) > self.size:
+                    # A process which failed may be in an inconsistent state: it's restarted on next use.
+                    instance.close()
+                if len(self._instances) > self.size:
+                    self._instances.remove(instance)
+                else:
+                    self._idle.append(instance)
+                self._condition.notify()
+
+    def analyze(self, text: str) -> list:
+        """
+        Make morphology analysis for a text (see `Mystem.analyze`).
+        """
+        with self.acquire() as instance, instrumentation.timed("Mystem"):
+            return instance.analyze(text)
+
+    def analyze_lines(self, lines: List[str]) -> List[list]:
+        """
+        Make morphology analysis for lines sending all of them to one Mystem process at once.
+
+        Mystem analyzes each line of its input on its own (that's how `Mystem.analyze` gets one answer per line),
+        so an analysis of a line is the one `analyze` returns for the line, whatever lines are sent with it.
+        That's checked on the first lines a pool sends at once and then on a line of every `CHECK_PERIOD` ones:
+        if an analysis differs, lines are sent one by one from then on.
+
+        :param lines: Lines to analyze (without line breaks).
+
+        :return: A list of analyses (one per line).
+        """
+        with self.acquire() as instance, instrumentation.timed("Mystem"):
+            if not self._lines_supported or not lines:
+                return [instance._analyze_impl(line) for line in lines]
+            analyses = request_lines(instance, lines)
+            if len(lines) == 1:
+                # It's the request `analyze` makes.
+                return analyses
+            checked = max(CHECKED_LINES - self._checked_lines, 0)
+            self._unchecked_lines += len(lines)
+            if not checked and self._unchecked_lines >= CHECK_PERIOD:
+                checked = 1
+            if checked:
+                self._checked_lines += min(checked, len(lines))
+                self._unchecked_lines = 0
+            for line, analysis in zip(lines[:checked], analyses):
+                if instance._analyze_impl(line) != analysis:
+                    logging.warning("Mystem analyzes lines sent at once differently, they're sent one by one.")
+                    self._lines_supported = False
+                    return [instance._analyze_impl(line) for line in lines]
+            return analyses
+
+    def lemmatize(self, text: str) -> List[str]:
+        """
+        Get a list of lemmas of a text (see `Mystem.lemmatize`).
+        """
+        with self.acquire() as instance, instrumentation.timed("Mystem"):
+            return instance.lemmatize(text)
+
+    def resize(self, size: int):
+        """
+        Change a maximal number of Mystem processes. Extra processes are stopped when they're released.
+        """
+        if size < 1:
+            raise ValueError("A pool size should be positive: {}".format(size))
+        with self._condition:
+            self.size = size
+            while len(self._instances) > size and self._idle:
+                instance = self._idle.pop()
+                instance.close()
+                self._instances.remove(instance)
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Stop all the idle Mystem processes (they're started again if the pool is used later).
+        """
+        with self._condition:
+            for instance in self._idle:
+                instance.close()
+
+
+POOL = MystemPool()
+
+
+def configure(size: int):
+    """
+    Set a number of Mystem processes a process may run.
+    """
+    POOL.resize(size)
+
+
+atexit.register(POOL.close)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+A deterministic stand-in for Mystem used by benchmark.py to run without the real binary.
+
+It speaks the protocol pymystem3 uses (a line of text in, a line of JSON out) and guesses lemmas and parts of speech
+by word endings, so the analyses are plausible but not accurate. Words with a letter repeated three times
+(like typos produced by benchmark.py) are marked as unknown ("bastard"). To use it, point MYSTEM_BIN to this file.
+"""
+
+import json
+import re
+import sys
+
+TOKEN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*|\d+|\s+|[^\w\s]+|_+")
+CYRILLIC = re.compile(r"^[а-яё-]+$")
+TYPO = re.compile(r"(\w)\1\1")
+
+FUNCTION_WORDS = {
+    "и": "CONJ=", "а": "CONJ=", "но": "CONJ=", "или": "CONJ=", "что": "CONJ=", "как": "ADVPRO=",
+    "в": "PR=", "во": "PR=", "на": "PR=", "у": "PR=", "с": "PR=", "со": "PR=", "под": "PR=", "для": "PR=",
+    "по": "PR=", "к": "PR=", "от": "PR=", "из": "PR=", "за": "PR=", "о": "PR=", "без": "PR=", "около": "PR=",
+    "не": "PART=", "ни": "PART=", "бы": "PART=", "же": "PART=", "нет": "PRED=",
+    "очень": "ADV=", "много": "ADV=", "мало": "ADV=", "больше": "ADV=", "меньше": "ADV=", "всё": "ADV=",
+    "все": "APRO=мн,им", "этот": "APRO=им,ед,муж", "всего": "ADV=", "ничего": "SPRO,ед,сред,неод=род",
+}
+
+ADJECTIVE_ENDINGS = ("ого", "его", "ому", "ему", "ыми", "ими", "ый", "ий", "ой", "ая", "яя", "ое", "ее", "ые", "ие",
+                     "ых", "их", "ым", "им", "ую", "юю")
+VERB_ENDINGS = ("ться", "ть", "ти")
+
+
+def analyze_word(word: str, weight: bool) -> dict:
+    lower = word.lower()
+    analysis = {"lex": lower}
+    if lower in FUNCTION_WORDS:
+        analysis["gr"] = FUNCTION_WORDS[lower]
+    elif lower.endswith(VERB_ENDINGS):
+        analysis["gr"] = "V,несов,пе=инф"
+    elif len(lower) > 4 and lower.endswith(ADJECTIVE_ENDINGS):
+        ending = next(i for i in ADJECTIVE_ENDINGS if lower.endswith(i))
+        stem = lower[:-len(ending)]
+        analysis["lex"] = stem + ("ий" if stem[-1] in "гкхжшчщ" else "ый")
+        analysis["gr"] = "A=им,ед,полн,муж"
+    else:
+        analysis["gr"] = "S,жен,неод=им,ед"
+    if TYPO.search(lower):
+        analysis["qual"] = "bastard"
+    if weight:
+        analysis["wt"] = 1
+    return analysis
+
+
+def analyze_line(line: str, weight: bool) -> list:
+    tokens = []
+    for token in TOKEN.findall(line):
+        if CYRILLIC.match(token.lower()):
+            tokens.append({"analysis": [analyze_word(token, weight)], "text": token})
+        elif token[0].isalpha():
+            tokens.append({"analysis": [], "text": token})
+        else:
+            tokens.append({"text": token})
+    tokens.append({"text": "\n"})
+    return tokens
+
+
+if __name__ == "__main__":
+    weight = "--weight" in sys.argv
+    for raw_line in sys.stdin.buffer:
+        text = raw_line.decode("utf-8").rstrip("\n")
+        sys.stdout.buffer.write(json.dumps(analyze_line(text, weight), ensure_ascii=False).encode("utf-8") + b"\n")
+        sys.stdout.buffer.flush()
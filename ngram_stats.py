@@ -0,0 +1,122 @@
+"""
+N-gram statistics of lemmatized texts computed with integer-id arrays.
+
+The counts and scores are the same as the ones of NLTK's TextCollection (IDF)
+and Bigram/TrigramCollocationFinder.from_documents (Poisson-Stirling measure).
+"""
+
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+
+class NgramStatistics(object):
+    """
+    Unigram, bigram and trigram counts of a collection of documents.
+
+    Tokens are mapped to integer ids in the order of their first occurrence,
+    documents are stored as one array of ids with document boundaries.
+    """
+
+    def __init__(self, texts: List[List[str]]):
+        """
+        :param texts: A list of documents, each one is a list of tokens.
+        """
+        self.vocabulary = OrderedDict()
+        ids = []
+        for text in texts:
+            ids.append([self.vocabulary.setdefault(token, len(self.vocabulary)) for token in text])
+        self.words = list(self.vocabulary)
+        self.documents_number = len(texts)
+        lengths = np.array([len(doc) for doc in ids], dtype=np.int64)
+        self.tokens = np.fromiter((i for doc in ids for i in doc), dtype=np.int64, count=int(lengths.sum()))
+        # A number of a document each token belongs to.
+        self._doc_of_token = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        size = len(self.words)
+        self.unigram_counts = np.bincount(self.tokens, minlength=size)
+        unique_in_docs = np.unique(self._doc_of_token * max(size, 1) + self.tokens) % max(size, 1)
+        self.document_frequencies = np.bincount(unique_in_docs, minlength=size)
+
+    @property
+    def total(self) -> int:
+        return len(self.tokens)
+
+    def idf(self) -> np.ndarray:
+        """
+        Calculate inverse document frequencies of all the words (0 for a word not found in any document).
+
+        :return: An array indexed by word ids.
+        """
+        df = self.document_frequencies
+        with np.errstate(divide="ignore"):
+            return np.where(df > 0, np.log(self.documents_number / np.maximum(df, 1)), 0.0)
+
+    def _windows(self, n: int) -> List[np.ndarray]:
+        """
+        Get ids of n adjacent words within one document.
+
+        :return: A list of n arrays: ids of the first words, the second ones, etc.
+        """
+        if self.total < n:
+            return [np.zeros(0, dtype=np.int64) for _ in range(n)]
+        last = self.total - n + 1
+        same_doc = self._doc_of_token[:last] == self._doc_of_token[n - 1:]
+        return [self.tokens[shift:last + shift][same_doc] for shift in range(n)]
+
+    def _encode(self, columns: List[np.ndarray]) -> np.ndarray:
+        key = np.zeros(len(columns[0]), dtype=np.int64)
+        for column in columns:
+            key = key * len(self.words) + column
+        return key
+
+    def _decode(self, keys: np.ndarray, n: int) -> List[np.ndarray]:
+        columns = []
+        for _ in range(n):
+            columns.append(keys % max(len(self.words), 1))
+            keys = keys // max(len(self.words), 1)
+        return list(reversed(columns))
+
+    def bigram_scores(self) -> Tuple[List[np.ndarray], np.ndarray]:
+        """
+        Score bigrams of adjacent words with the Poisson-Stirling measure.
+
+        :return: Bigrams (a pair of arrays of word ids) and an array of their scores.
+        """
+        keys, n_ii = np.unique(self._encode(self._windows(2)), return_counts=True)
+        w1, w2 = self._decode(keys, 2)
+        expected = (self.unigram_counts[w1] * self.unigram_counts[w2]) / self.total
+        scores = n_ii * (np.log2(n_ii / expected) - 1)
+        return [w1, w2], scores
+
+    def trigram_scores(self) -> Tuple[List[np.ndarray], np.ndarray]:
+        """
+        Score trigrams of adjacent words with the Poisson-Stirling measure.
+
+        :return: Trigrams (three arrays of word ids) and an array of their scores.
+        """
+        keys, n_iii = np.unique(self._encode(self._windows(3)), return_counts=True)
+        w1, w2, w3 = self._decode(keys, 3)
+        counts = self.unigram_counts
+        expected = (counts[w1] * counts[w2] * counts[w3]) / (self.total ** 2)
+        scores = n_iii * (np.log2(n_iii / expected) - 1)
+        return [w1, w2, w3], scores
+
+    def nbest(self, ngrams: List[np.ndarray], scores: np.ndarray, n: int) -> List[Tuple[str, ...]]:
+        """
+        Get n ngrams with the highest scores (ties are ordered by the ngrams themselves, as NLTK does).
+
+        :param ngrams: Ngrams as arrays of word ids (see bigram_scores and trigram_scores).
+        :param scores: An array of their scores.
+        :param n: A number of ngrams to return.
+
+        :return: A list of ngrams as tuples of words.
+        """
+        candidates = np.arange(len(scores))
+        if len(scores) > n:
+            threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+            candidates = candidates[scores >= threshold]
+        best = [(-scores[i], tuple(self.words[column[i]] for column in ngrams)) for i in candidates]
+        best.sort()
+        return [ngram for _, ngram in best[:n]]
@@ -0,0 +1,111 @@
+"""
+A thread pipeline processing items concurrently while keeping their order.
+
+Items are read by a separate thread, processed by several worker threads and yielded in the order they're read.
+Queues between the stages are bounded, so a slow item delays reading of new ones instead of
+letting the results of the following items pile up in memory.
+Threads pay off when processing waits for other processes (e.g. Mystem, see mystem_pool.py):
+while one thread waits for an analysis, another one can match its results.
+"""
+
+import queue
+import sys
+import threading
+
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# A marker of the end of a queue.
+_DONE = object()
+
+
+class _Failure(object):
+    """
+    An exception raised by a stage, passed to the consumer to be re-raised there.
+    """
+    __slots__ = ("exc_info",)
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def ordered_map(func: Callable[[T], R], items: Iterable[T], threads: int, queue_size: int = 0) -> Iterator[R]:
+    """
+    Apply a function to items in several threads.
+
+    :param func: A function to apply; it should be safe to call it from several threads at once.
+    :param items: An iterable of items (it's read in a separate thread).
+    :param threads: A number of worker threads. With one thread, items are processed in the calling thread.
+    :param queue_size: A maximal number of items in flight, i.e. read but not yielded yet
+        (4 per thread by default).
+
+    :return: An iterator over results in the order of the items.
+
+    :raises Exception: Any exception raised while reading or processing items is re-raised by the iterator.
+    """
+    if threads < 1:
+        raise ValueError("A number of threads should be positive: {}".format(threads))
+    if threads == 1:
+        yield from map(func, items)
+        return
+    queue_size = queue_size or 4 * threads
+    in_flight = threading.BoundedSemaphore(queue_size)
+    tasks, results = queue.Queue(queue_size), queue.Queue()
+    stopped = threading.Event()
+
+    def read():
+        num = 0
+        try:
+            for item in items:
+                while not in_flight.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                tasks.put((num, item))
+                num += 1
+        except BaseException:
+            # Raised after the results of the items read before.
+            results.put((num, _Failure(sys.exc_info())))
+        finally:
+            for _ in range(threads):
+                tasks.put(_DONE)
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is _DONE:
+                results.put((None, _DONE))
+                return
+            num, item = task
+            if stopped.is_set():
+                continue
+            try:
+                results.put((num, func(item)))
+            except BaseException:
+                results.put((num, _Failure(sys.exc_info())))
+
+    workers = [threading.Thread(target=read, name="pipeline-reader", daemon=True)]
+    workers.extend(threading.Thread(target=work, name="pipeline-worker-{}".format(i), daemon=True)
+                   for i in range(threads))
+    for thread in workers:
+        thread.start()
+
+    # Results finished out of order wait here until the preceding ones are done.
+    pending, next_num, running = {}, 0, threads
+    try:
+        while running:
+            num, result = results.get()
+            if result is _DONE:
+                running -= 1
+                continue
+            pending[num] = result
+            while next_num in pending:
+                result = pending.pop(next_num)
+                if isinstance(result, _Failure):
+                    raise result.exc_info[1].with_traceback(result.exc_info[2])
+                in_flight.release()
+                yield result
+                next_num += 1
+    finally:
+        stopped.set()
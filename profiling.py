@@ -0,0 +1,189 @@
+"""
+A call profile of a run of a script: cProfile statistics and collapsed stacks for flame graphs.
+
+With `--profile PATH` (see `add_arguments` and `configure`), the rest of the run is profiled, and at exit
+
+* cProfile statistics of all the threads are saved to PATH (read them with `python -m pstats PATH`);
+* stacks sampled every few milliseconds are saved to PATH.collapsed, one line per stack with a number of samples
+  (the format of flamegraph.pl, speedscope and similar tools).
+
+In the stacks, processing stages (see instrumentation.py) are shown as frames in brackets, e.g. `[negation chunking]`,
+and frames of pymystem3 and enchant are collapsed into `Mystem` and `enchant` leaves. Time spent waiting for Mystem
+is thus shown under the stage which called it rather than as generic subprocess I/O.
+"""
+
+import atexit
+import cProfile
+import collections
+import os
+import pstats
+import queue
+import sys
+import threading
+
+from typing import List, Union
+
+import instrumentation
+
+SAMPLING_INTERVAL = 0.005
+
+# Packages whose frames are collapsed into one leaf: a directory name -> a name of the leaf.
+_COLLAPSED_PACKAGES = {
+    "pymystem3": "Mystem",
+    "enchant": "enchant",
+}
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__")
+    if not module or module == "__main__":
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return "{}:{}".format(module, getattr(code, "co_qualname", code.co_name))
+
+
+def _collapsed_leaf(frame) -> Union[str, None]:
+    parts = frame.f_code.co_filename.split(os.sep)
+    for package, leaf in _COLLAPSED_PACKAGES.items():
+        if package in parts:
+            return leaf
+    return None
+
+
+def collapse_stack(frame, stages: list, skip_files=()) -> List[str]:
+    """
+    Convert a stack of a thread to a list of names of frames, from the outermost one.
+
+    :param frame: The innermost frame of the thread.
+    :param stages: Pairs (a frame, a stage) of stages running in the thread (see instrumentation.running_stages).
+    :param skip_files: Paths of files whose frames are omitted.
+
+    :return: A list of names of frames with stages inserted after the frames they're started in.
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    stage_frames = collections.defaultdict(list)
+    for stage_frame, stage in stages:
+        if stage_frame is not None:
+            stage_frames[id(stage_frame)].append(stage)
+
+    names = []
+    for frame in frames:
+        leaf = _collapsed_leaf(frame)
+        if leaf is not None:
+            names.append(leaf)
+            break
+        if frame.f_code.co_filename not in skip_files:
+            names.append(_frame_name(frame))
+        names.extend("[{}]".format(stage) for stage in stage_frames.get(id(frame), ()))
+    return names
+
+
+class Profiler(object):
+    """
+    A cProfile profiler of all the threads of a process together with a sampler of their stacks.
+    """
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        """
+        :param interval: Seconds between stack samples.
+        """
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._skip_files = {instrumentation.__file__, __file__, threading.__file__}
+        # Threads waiting in these files are idle (e.g. waiting for a task) and aren't sampled.
+        self._idle_files = {threading.__file__, queue.__file__}
+
+    def _new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _profile_thread(self, *args):
+        # Called on the first event of a new thread: replaces itself with a profiler of the thread.
+        sys.setprofile(None)
+        try:
+            self._new_profile().enable()
+        except ValueError:
+            # Since Python 3.12, a profiler is enabled for all the threads at once and the main one covers them.
+            pass
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_filename in self._idle_files:
+                    continue
+                stack = collapse_stack(frame, instrumentation.running_stages(thread_id), self._skip_files)
+                if stack:
+                    self.samples[";".join(stack)] += 1
+
+    def start(self):
+        instrumentation.enable(report_at_exit=False, track_frames=True)
+        # The sampler is started first not to be profiled itself.
+        self._sampler.start()
+        threading.setprofile(self._profile_thread)
+        self._main_profile = self._new_profile()
+        self._main_profile.enable()
+
+    def stop(self):
+        self._main_profile.disable()
+        threading.setprofile(None)
+        self._stopped.set()
+        self._sampler.join()
+
+    def save(self, path: str):
+        """
+        Save cProfile statistics to a file and collapsed stacks to a file with the ".collapsed" suffix.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            # Threads still running are profiled until they stop; what's collected so far is saved.
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is not None:
+            stats.dump_stats(path)
+        with open(path + ".collapsed", "w") as f:
+            for stack, number in sorted(self.samples.items()):
+                print(stack, number, file=f)
+
+
+def add_arguments(parser):
+    """
+    Add an option turning profiling on to a parser of a script.
+    """
+    parser.add_argument("--profile", type=str, metavar="PATH",
+                        help="save cProfile statistics of the run to PATH and stacks for flame graphs "
+                             "to PATH.collapsed")
+
+
+def configure(parsed):
+    """
+    Start profiling if it's requested by the options parsed (see `add_arguments`); the results are saved at exit.
+    """
+    if parsed.profile is None:
+        return
+    path = os.path.expanduser(os.path.abspath(parsed.profile))
+    profiler = Profiler()
+    profiler.start()
+
+    @atexit.register
+    def save_profile():
+        profiler.stop()
+        profiler.save(path)
+        print("Profile saved to {0} and {0}.collapsed".format(path), file=sys.stderr)
@@ -3,11 +3,18 @@ A collection of various readers for different types of files.
 """
 
 import csv
+import hashlib
 import logging
+import math
+import os
+import sqlite3
+import tempfile
 
-from typing import List, Tuple
+from typing import Iterator, List, Tuple, Union
 from collections import OrderedDict
 
+from columnar import ColumnarTable, is_columnar
+
 
 def read_csv_dictionaries(fns, ignore_fst_col, delimiter=","):
     matches = OrderedDict()
@@ -58,26 +65,173 @@ def read_wordlists(fns, as_csv=True):
     return words
 
 
-def read_columns(fn: str, *columns: List[int]) -> List[Tuple[int, str]]:
+class DuplicateFilter(object):
     """
-    Read text from all the columns specified.
+    A class detecting repeated table lines (the first occurrence of a line is not a duplicate).
+
+    Only 128-bit digests of lines are kept. They're stored in a set ('memory' mode), in an SQLite file
+    ('disk' mode) or in a Bloom filter ('bloom' mode). The latter takes the least memory,
+    but may rarely treat a new line as a duplicate.
+    """
+    MODES = ("memory", "disk", "bloom")
+
+    def __init__(self, key_columns: Union[List[int], None] = None, mode="memory", capacity=10 ** 7, error_rate=1e-6):
+        """
+        :param key_columns: Numbers of columns to compare lines by (starting from 1).
+            By default, all the columns except the first one (a respondent's ID) are compared.
+        :param mode: A storage of digests: 'memory', 'disk' or 'bloom'.
+        :param capacity: An expected number of lines ('bloom' mode only).
+        :param error_rate: A desired rate of false duplicates ('bloom' mode only).
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown duplicate detection mode: {}".format(mode))
+        self.key_columns = key_columns
+        self.mode = mode
+        self.duplicates = 0
+        if mode == "memory":
+            self._seen = set()
+        elif mode == "disk":
+            fd, self._path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+            self._conn = sqlite3.connect(self._path)
+            self._conn.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        else:
+            self._bits_number = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            self._hashes_number = max(1, round(self._bits_number / capacity * math.log(2)))
+            self._bits = bytearray((self._bits_number + 7) // 8)
+
+    def digest(self, line: List[str]) -> bytes:
+        """
+        Calculate a digest of a line.
+
+        :param line: A list of cells.
+
+        :return: A 128-bit digest of the stripped key cells.
+        """
+        if self.key_columns is None:
+            cells = line[1:]
+        else:
+            cells = [line[num - 1] if num <= len(line) else "" for num in self.key_columns]
+        digest = hashlib.blake2b(digest_size=16)
+        for cell in cells:
+            cell = cell.strip().encode("utf-8")
+            digest.update(len(cell).to_bytes(4, "little"))
+            digest.update(cell)
+        return digest.digest()
+
+    def _add(self, digest: bytes) -> bool:
+        if self.mode == "memory":
+            if digest in self._seen:
+                return False
+            self._seen.add(digest)
+            return True
+        if self.mode == "disk":
+            return self._conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (digest,)).rowcount == 1
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        is_new = False
+        for num in range(self._hashes_number):
+            bit = (first + num * second) % self._bits_number
+            if not self._bits[bit >> 3] & (1 << (bit & 7)):
+                is_new = True
+                self._bits[bit >> 3] |= 1 << (bit & 7)
+        return is_new
+
+    def is_duplicate(self, line: List[str]) -> bool:
+        """
+        Check whether a line has already been seen and remember it.
+
+        :param line: A list of cells.
+
+        :return: True if an equal line has been seen before.
+        """
+        if self._add(self.digest(line)):
+            return False
+        self.duplicates += 1
+        logging.debug("Line's a duplicate: %s", line)
+        return True
+
+    def close(self):
+        if self.duplicates:
+            logging.warning("Duplicate lines skipped: %d", self.duplicates)
+        if self.mode == "disk" and self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            os.remove(self._path)
+
+
+def iter_rows(fn: str, columns: Union[List[int], None] = None) -> Iterator[List[str]]:
+    """
+    Iterate over rows of a CSV table or a table saved in the columnar format (see columnar.py).
+
+    :param fn: A path to a table file or a columnar table directory.
+    :param columns: Numbers of columns which are needed (starting from 0). If a table is columnar,
+        other cells are not read and replaced with empty strings. By default, all the cells are read.
+
+    :return: An iterator over lists of cells.
+    """
+    if is_columnar(fn):
+        with ColumnarTable(fn) as table:
+            yield from table.rows(columns)
+    else:
+        with open(fn) as f:
+            yield from csv.reader(f, delimiter=",")
 
-    :param fn: A path to a table file.
+
+def iter_cells(fn: str, column: int) -> Iterator[str]:
+    """
+    Iterate over cells of a column of a table (rows too short to have the column are skipped).
+
+    :param fn: A path to a table file or a columnar table directory.
+    :param column: A number of a column (starting from 0).
+
+    :return: An iterator over cells.
+    """
+    if is_columnar(fn):
+        with ColumnarTable(fn) as table:
+            yield from (cell for cell in table.cells(column) if cell is not None)
+    else:
+        with open(fn) as f:
+            yield from (line[column] for line in csv.reader(f, delimiter=",") if column < len(line))
+
+
+def iter_columns(fn: str, *columns: List[int], duplicates: Union[DuplicateFilter, None] = None
+                 ) -> Iterator[Tuple[int, str]]:
+    """
+    Read text from all the columns specified lazily, one line at a time.
+
+    :param fn: A path to a table file or a columnar table directory.
     :param columns: A list of column numbers to read data from (WARNING: nums should start from 1).
+    :param duplicates: A filter to skip repeated lines with (by default, lines are compared
+        by all the columns but the first one and digests are kept in memory).
 
-    :return: A list of pairs (line number, answer text).
+    :return: An iterator over pairs (line number, answer text).
     """
-    answers = []
-    ignored_lines = set()
-    with open(fn) as f:
-        reader = csv.reader(f, delimiter=",")
+    if duplicates is None:
+        duplicates = DuplicateFilter()
+    needed = None
+    if duplicates.key_columns is not None:
+        needed = sorted({i - 1 for i in columns} | {i - 1 for i in duplicates.key_columns})
+    try:
+        reader = iter_rows(fn, needed)
         next(reader, None)
         for num, line in enumerate(reader):
-            line_snapshot = tuple(i.strip() for i in line[1:])
-            if line_snapshot in ignored_lines:
-                logging.warning("Line's a duplicate: %s", line_snapshot)
+            if duplicates.is_duplicate(line):
                 continue
-            ignored_lines.add(line_snapshot)
             line = [i.strip() for n, i in enumerate(line) if i.strip() and n + 1 in columns]
-            answers.extend(((num + 2, i) for i in set(line)))
-    return answers
\ No newline at end of file
+            yield from ((num + 2, i) for i in set(line))
+    finally:
+        duplicates.close()
+
+
+def read_columns(fn: str, *columns: List[int], duplicates: Union[DuplicateFilter, None] = None
+                 ) -> List[Tuple[int, str]]:
+    """
+    Read text from all the columns specified.
+
+    :param fn: A path to a table file or a columnar table directory.
+    :param columns: A list of column numbers to read data from (WARNING: nums should start from 1).
+    :param duplicates: A filter to skip repeated lines with (see iter_columns).
+
+    :return: A list of pairs (line number, answer text).
+    """
+    return list(iter_columns(fn, *columns, duplicates=duplicates))
\ No newline at end of file
@@ -1,6 +1,7 @@
-import re
-
-from answer import Answer
+from rules.engine import (
+    Add, AllOf, Contains, Discard, FirstOf, HasAny, HasMoreThan, LemmasIntersect, Nonverbal, Not, Regex, Replace, Rule,
+    RuleSet
+)
 
 PARKING_TEMPLATES = [
     (r'\bподземный (стоянка|паркинг)\b', "устроить подземную парковку", lambda a, b: b),
@@ -52,7 +53,7 @@ class HardcodeDictionary(object):
         "вывозить",
     ]
 
-    STOP_TRAFFIC = [
+    STOP_TRAFFIC = {
         "заблокировать",
         "запрещать",
         "ограничивать",
@@ -61,7 +62,7 @@ class HardcodeDictionary(object):
         "закрывать въезд",
         "исключать",
         "перекрывать"
-    ]
+    }
 
     GUNS = {
         "артиллерия",
@@ -89,98 +90,38 @@ class TagNames(object):
     STOP_TRAFFIC = "Ограничить въезд автотранспорта"
 
 
-class Postprocs(object):
-    """
-    A class embracing methods trying to re-assign some answers to a more precise category.
-    """
+NONVERBAL_PHRASE_TAGS = {"A", "S", None, "PR", 'CONJ', "ADV"}
 
-    dic = HardcodeDictionary
-    compiled_parking_templates = (lambda: [(re.compile(r), l, f) for r, l, f in PARKING_TEMPLATES])()
-    nonverbal_phrase_tags = {"A", "S", None, "PR", 'CONJ', "ADV"}
-
-    _simple_negation_re = re.compile(r"\bнет?\b")
-
-    @classmethod
-    def is_nonverbal(cls, pos_tags):
-        return not (set(pos_tags) - cls.nonverbal_phrase_tags)
-
-    @classmethod
-    def _assign_headlines_parking(cls, lemmas, pos_tags, hl_set):
-        for regex, label, func in cls.compiled_parking_templates:
-            m = regex.search(lemmas)
-            if m:
-                hl_set.add(func(m, label))
-                break
-        else:
-            if cls.is_nonverbal(pos_tags) and not cls._simple_negation_re.search(lemmas):
-                if not "вело" in lemmas:
-                    hl_set.add("устроить парковку")
-
-    @classmethod
-    def _assign_headlines_zoo(cls, lemmas, pos_tags, additional_headlines):
-        approval_label = "Закрыть зоопарк"
-
-        regex = r"({})[^,().!]+?({})".format("|".join(cls.dic.REMOVAL_NAMES), "(зоопарк|зоосад)")
-        if re.search(regex, lemmas):
-            additional_headlines.add(approval_label)
-            return
-
-
-    @classmethod
-    def no_change_postproc(cls, answer, hls):
-        if TagNames.NO_CHANGE_REQUIRED in hls:
-            if len(hls) > 1:
-                hls.discard(TagNames.NO_CHANGE_REQUIRED)
-
-    @classmethod
-    def parking_postproc(cls, answer, hls):
-        if TagNames.PARKING_GENERAL in hls:
-            additional_headlines = set()
-            cls._assign_headlines_parking(
-                answer.get_lemmas(False, True),
-                answer.pos_tags,
-                additional_headlines
-            )
-            if additional_headlines:
-                hls.remove(TagNames.PARKING_GENERAL)
-                hls.update({i.capitalize() for i in additional_headlines})
-
-    @classmethod
-    def zoo_postproc(cls, answer: Answer, hls: set):
-        if TagNames.ZOO in hls:
-            cls._assign_headlines_zoo(
-                answer.get_lemmas(False, True).lower(),
-                answer.pos_tags,
-                hls
-            )
-            hls.discard(TagNames.ZOO)
-
-    @classmethod
-    def embankment_processing(cls, answer: Answer, hls: set):
-        if TagNames.EMBANKMENT_RENOVATION in hls:
-            hls.discard(TagNames.EMBANKMENT)
-
-
-    @classmethod
-    def bridge_processing(cls, answer: Answer, hls: set):
-        if TagNames.BRIDGE in hls:
-            if set(i.lower() for i in answer.get_lemmas(False, False)) & cls.dic.GUNS:
-                hls.discard(TagNames.BRIDGE)
-                hls.add(TagNames.BRIDGE_TO_ARTILLERY)
-
-    @classmethod
-    def traffic_processing(self, answer: Answer, hls: set):
-        if TagNames.TRAFFIC in hls:
-            if set(i.lower() for i in answer.get_lemmas(False, False)) & set(self.dic.STOP_TRAFFIC):
-                hls.discard(TagNames.TRAFFIC)
-                hls.add(TagNames.STOP_TRAFFIC)
-
-
-POSTPROCESSING_SEQUENCE = [
-        Postprocs.no_change_postproc,
-        Postprocs.parking_postproc,
-        Postprocs.zoo_postproc,
-        Postprocs.bridge_processing,
-        Postprocs.traffic_processing,
+ZOO_REMOVAL = r"({})[^,().!]+?({})".format("|".join(HardcodeDictionary.REMOVAL_NAMES), "(зоопарк|зоосад)")
 
-    ]
+_simple_negation = Regex(r"\bнет?\b")
+
+
+def _parking_label(label, func):
+    return lambda match: func(match, label).capitalize()
+
+
+RULES = RuleSet([
+    Rule(when=AllOf(HasAny(TagNames.NO_CHANGE_REQUIRED), HasMoreThan(1)), then=Discard(TagNames.NO_CHANGE_REQUIRED)),
+
+    FirstOf(*[
+        Rule(when=HasAny(TagNames.PARKING_GENERAL), pattern=Regex(regex),
+             then=Replace(TagNames.PARKING_GENERAL, _parking_label(label, func)))
+        for regex, label, func in PARKING_TEMPLATES
+    ] + [
+        Rule(when=HasAny(TagNames.PARKING_GENERAL),
+             pattern=AllOf(Nonverbal(NONVERBAL_PHRASE_TAGS), Not(_simple_negation), Not(Contains("вело"))),
+             then=Replace(TagNames.PARKING_GENERAL, "Устроить парковку")),
+    ]),
+
+    Rule(when=HasAny(TagNames.ZOO), pattern=Regex(ZOO_REMOVAL, lower=True), then=Add("Закрыть зоопарк")),
+    Rule(when=HasAny(TagNames.ZOO), then=Discard(TagNames.ZOO)),
+
+    Rule(when=HasAny(TagNames.BRIDGE), pattern=LemmasIntersect(HardcodeDictionary.GUNS),
+         then=Replace(TagNames.BRIDGE, TagNames.BRIDGE_TO_ARTILLERY)),
+
+    Rule(when=HasAny(TagNames.TRAFFIC), pattern=LemmasIntersect(HardcodeDictionary.STOP_TRAFFIC),
+         then=Replace(TagNames.TRAFFIC, TagNames.STOP_TRAFFIC)),
+])
+
+POSTPROCESSING_SEQUENCE = [RULES.apply]
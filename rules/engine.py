@@ -0,0 +1,410 @@
+"""
+A declarative format of postprocessing rules and an engine applying them to batches of answers.
+
+A rule consists of:
+
+* a condition on tags already assigned to an answer (`HasAny`, `HasAll`, `HasMoreThan`);
+* a pattern the lemmas of the answer should match (`Regex`, `Contains`, `LemmasIntersect`, `Check`);
+* a constraint on parts of speech of the answer (`Nonverbal`);
+* actions changing the tag set (`Add`, `Discard`, `Replace`, `KeepOnly`).
+
+Conditions are combined with `AllOf`, `AnyOf` and `Not`. Rules of a `RuleSet` are applied in order;
+`FirstOf` applies only the first of several rules whose conditions hold.
+"""
+
+import abc
+import re
+import time
+
+from typing import Callable, Iterable, List, Set, Union
+
+import instrumentation
+
+
+class AnswerView(object):
+    """
+    Data derived from an answer once and shared by all the rules applied to it.
+    """
+    __slots__ = ("answer", "_text", "_lower_text", "_lemmas", "_lower_lemmas", "_pos_tags", "_pos_set")
+
+    def __init__(self, answer):
+        """
+        :param answer: An answer (see answer.Answer).
+        """
+        self.answer = answer
+        self._text = self._lower_text = self._lemmas = self._lower_lemmas = self._pos_tags = self._pos_set = None
+
+    @property
+    def text(self) -> str:
+        """
+        Lemmas (including punctuation) joined with spaces.
+        """
+        if self._text is None:
+            self._text = self.answer.get_lemmas(False, True)
+        return self._text
+
+    @property
+    def lower_text(self) -> str:
+        if self._lower_text is None:
+            self._lower_text = self.text.lower()
+        return self._lower_text
+
+    @property
+    def lemmas(self) -> List[str]:
+        """
+        Lemmas including punctuation.
+        """
+        if self._lemmas is None:
+            self._lemmas = self.answer.get_lemmas(False, False)
+        return self._lemmas
+
+    @property
+    def lower_lemmas(self) -> Set[str]:
+        if self._lower_lemmas is None:
+            self._lower_lemmas = {i.lower() for i in self.lemmas}
+        return self._lower_lemmas
+
+    @property
+    def pos_tags(self) -> list:
+        if self._pos_tags is None:
+            self._pos_tags = self.answer.pos_tags
+        return self._pos_tags
+
+    @property
+    def pos_set(self) -> set:
+        if self._pos_set is None:
+            self._pos_set = set(self.pos_tags)
+        return self._pos_set
+
+
+class Condition(object, metaclass=abc.ABCMeta):
+    """
+    A base class of conditions. A condition is tested against an answer and a set of its tags.
+    """
+
+    @abc.abstractmethod
+    def test(self, view: AnswerView, tags: Set[str]):
+        """
+        :return: A truthy value (e.g. a match object) if the condition holds, otherwise a falsy one.
+        """
+
+
+class HasAny(Condition):
+    def __init__(self, *tags: str):
+        self.tags = tags
+
+    def test(self, view, tags):
+        return any(i in tags for i in self.tags)
+
+
+class HasAll(Condition):
+    def __init__(self, *tags: str):
+        self.tags = tags
+
+    def test(self, view, tags):
+        return all(i in tags for i in self.tags)
+
+
+class HasMoreThan(Condition):
+    def __init__(self, number: int):
+        self.number = number
+
+    def test(self, view, tags):
+        return len(tags) > self.number
+
+
+class Regex(Condition):
+    """
+    A regex searched for (or matched at the start of) lemmas joined with spaces.
+    """
+
+    def __init__(self, pattern: Union[str, "re.Pattern"], lower=False, anchored=False):
+        """
+        :param pattern: A regular expression.
+        :param lower: If True, the text is lowercased first.
+        :param anchored: If True, the regex should match at the start of the text (`re.match`).
+        """
+        self.regex = re.compile(pattern)
+        self.lower = lower
+        self.anchored = anchored
+
+    def test(self, view, tags):
+        text = view.lower_text if self.lower else view.text
+        return self.regex.match(text) if self.anchored else self.regex.search(text)
+
+
+class Contains(Condition):
+    """
+    A substring of lemmas joined with spaces.
+    """
+
+    def __init__(self, substring: str):
+        self.substring = substring
+
+    def test(self, view, tags):
+        return self.substring in view.text
+
+
+class LemmasIntersect(Condition):
+    """
+    Any of the (lowercased) lemmas of an answer belonging to a set of words.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = frozenset(words)
+
+    def test(self, view, tags):
+        return not view.lower_lemmas.isdisjoint(self.words)
+
+
+class Nonverbal(Condition):
+    """
+    All the parts of speech of an answer belonging to a set of tags.
+    """
+
+    def __init__(self, pos_tags: Iterable[Union[str, None]]):
+        self.pos_tags = frozenset(pos_tags)
+
+    def test(self, view, tags):
+        return view.pos_set <= self.pos_tags
+
+
+class Check(Condition):
+    """
+    A condition calculated by a function of lemmas and their parts of speech, for checks not expressible otherwise.
+    """
+
+    def __init__(self, func: Callable[[List[str], list], bool]):
+        self.func = func
+
+    def test(self, view, tags):
+        return self.func(view.lemmas, view.pos_tags)
+
+
+class AllOf(Condition):
+    """
+    All the conditions holding; the result of the first one is returned.
+    """
+
+    def __init__(self, *conditions: Condition):
+        self.conditions = conditions
+
+    def test(self, view, tags):
+        result = True
+        for num, condition in enumerate(self.conditions):
+            value = condition.test(view, tags)
+            if not value:
+                return None
+            if num == 0:
+                result = value
+        return result
+
+
+class AnyOf(Condition):
+    """
+    Any of the conditions holding; the result of the first one holding is returned.
+    """
+
+    def __init__(self, *conditions: Condition):
+        self.conditions = conditions
+
+    def test(self, view, tags):
+        for condition in self.conditions:
+            value = condition.test(view, tags)
+            if value:
+                return value
+        return None
+
+
+class Not(Condition):
+    def __init__(self, condition: Condition):
+        self.condition = condition
+
+    def test(self, view, tags):
+        return not self.condition.test(view, tags)
+
+
+# A label is either a tag or a function making a tag of a match of a rule's pattern.
+Label = Union[str, Callable[[object], str]]
+
+
+def _label(label: Label, match) -> str:
+    return label if isinstance(label, str) else label(match)
+
+
+def _describe_action(action) -> str:
+    args = list(getattr(action, "tags", ()))
+    args.extend(getattr(action, name) for name in ("tag", "label") if hasattr(action, name))
+    return "{}({})".format(type(action).__name__, ", ".join(i if isinstance(i, str) else "..." for i in args))
+
+
+class Add(object):
+    def __init__(self, label: Label):
+        self.label = label
+
+    def __call__(self, tags, match):
+        tags.add(_label(self.label, match))
+
+
+class Discard(object):
+    def __init__(self, *tags: str):
+        self.tags = tags
+
+    def __call__(self, tags, match):
+        for i in self.tags:
+            tags.discard(i)
+
+
+class Replace(object):
+    """
+    Remove a tag and add another one.
+    """
+
+    def __init__(self, tag: str, label: Label):
+        self.tag = tag
+        self.label = label
+
+    def __call__(self, tags, match):
+        tags.discard(self.tag)
+        tags.add(_label(self.label, match))
+
+
+class KeepOnly(object):
+    """
+    Remove all the tags but one.
+    """
+
+    def __init__(self, tag: str):
+        self.tag = tag
+
+    def __call__(self, tags, match):
+        tags.clear()
+        tags.add(self.tag)
+
+
+class Rule(object):
+    """
+    Actions applied to a tag set of an answer if the answer meets all the conditions given.
+    """
+
+    def __init__(self, when: Condition = None, pattern: Condition = None, pos: Condition = None, then=()):
+        """
+        :param when: A condition on tags.
+        :param pattern: A condition on lemmas; its result (e.g. a regex match) is passed to the actions.
+        :param pos: A condition on parts of speech.
+        :param then: An action or a list of actions (see `Add`, `Discard`, `Replace`, `KeepOnly`).
+        """
+        self.when, self.pattern, self.pos = when, pattern, pos
+        self.actions = then if isinstance(then, (list, tuple)) else [then]
+
+    def match(self, view: AnswerView, tags: Set[str]):
+        """
+        :return: A result of the pattern (True if there's no pattern), or None if any condition doesn't hold.
+        """
+        if self.when is not None and not self.when.test(view, tags):
+            return None
+        if self.pos is not None and not self.pos.test(view, tags):
+            return None
+        if self.pattern is None:
+            return True
+        return self.pattern.test(view, tags) or None
+
+    def apply(self, view: AnswerView, tags: Set[str]) -> bool:
+        """
+        Apply the rule to an answer.
+
+        :return: True if the conditions hold and the actions are applied.
+        """
+        result = self.match(view, tags)
+        if result is None:
+            return False
+        for action in self.actions:
+            action(tags, result)
+        return True
+
+    def describe(self) -> str:
+        """
+        :return: A short description of the rule (its actions) for reports.
+        """
+        return ", ".join(_describe_action(action) for action in self.actions)
+
+
+class FirstOf(object):
+    """
+    A group of rules of which only the first one applicable is applied.
+    """
+
+    def __init__(self, *rules: Rule):
+        self.rules = rules
+
+    def apply(self, view: AnswerView, tags: Set[str]) -> bool:
+        return any(rule.apply(view, tags) for rule in self.rules)
+
+    def describe(self) -> str:
+        return "first of {}: {}".format(len(self.rules), self.rules[0].describe() if self.rules else "")
+
+
+class Call(object):
+    """
+    A postprocessing function `func(answer, tags)` used as a rule.
+    """
+
+    def __init__(self, func: Callable[[object, Set[str]], None]):
+        self.func = func
+
+    def apply(self, view: AnswerView, tags: Set[str]) -> bool:
+        self.func(view.answer, tags)
+        return True
+
+    def describe(self) -> str:
+        return getattr(self.func, "__qualname__", repr(self.func))
+
+
+class RuleSet(object):
+    """
+    A sequence of rules applied to answers in order.
+    """
+
+    def __init__(self, rules: Iterable[Union[Rule, FirstOf, Call]]):
+        self.rules = list(rules)
+
+    @classmethod
+    def from_module(cls, module) -> "RuleSet":
+        """
+        Get rules of a postprocessing module: its RULES or, if it doesn't define them, its POSTPROCESSING_SEQUENCE.
+        """
+        if hasattr(module, "RULES"):
+            return module.RULES
+        return cls(Call(func) for func in module.POSTPROCESSING_SEQUENCE)
+
+    def apply(self, answer, tags: Set[str]):
+        """
+        Apply the rules to one answer (the signature is the one of POSTPROCESSING_SEQUENCE functions).
+        """
+        self.apply_batch([answer], [tags])
+
+    def apply_batch(self, answers: list, tag_sets: List[Set[str]]):
+        """
+        Apply the rules to a batch of answers, one rule to all the answers at a time.
+
+        :param answers: A list of answers.
+        :param tag_sets: Sets of tags of the answers, changed in place.
+        """
+        views = [AnswerView(answer) for answer in answers]
+        if instrumentation.enabled:
+            self._apply_measured(views, tag_sets)
+            return
+        for rule in self.rules:
+            for view, tags in zip(views, tag_sets):
+                rule.apply(view, tags)
+
+    def _apply_measured(self, views: List[AnswerView], tag_sets: List[Set[str]]):
+        # Time of each rule is reported as a stage and attributed to the answers it's applied to.
+        for num, rule in enumerate(self.rules, 1):
+            with instrumentation.timed("rule {}: {}".format(num, rule.describe())):
+                for view, tags in zip(views, tag_sets):
+                    start = time.perf_counter()
+                    rule.apply(view, tags)
+                    instrumentation.add_answer_time(
+                        getattr(view.answer, "source", ""), time.perf_counter() - start
+                    )
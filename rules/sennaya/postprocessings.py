@@ -1,14 +1,11 @@
 #!/usr/local/bin/python3
 
-import csv
 import re
-import os
-import sys
-import time
 
-from answer import Answer
-from collections import namedtuple
-from readers import read_columns
+from rules.engine import (
+    Add, AllOf, AnyOf, Check, Contains, Discard, FirstOf, HasAll, HasAny, KeepOnly, Nonverbal, Not, Regex, Replace,
+    Rule, RuleSet
+)
 
 _PARKING_TEMPLATES = [
     (r'\bподземный (стоянка|паркинг)\b', "устроить подземную парковку", lambda a, b: b),
@@ -136,152 +133,83 @@ class TagNames(object):
     PEAK_GENERAL = 'ТК Пик'
 
 
-class Postprocs(object):
-    """
-    A class embracing methods trying to re-assign some answers to a more precise category.
+NONVERBAL_PHRASE_TAGS = {"A", "S", None, "PR", 'CONJ', "ADV"}
+
+SENTENCE_START = r'(?:((?:{trade}) с |быть(?: бы)? )(?:\w+?[оыи]й )?)?(?:{food_names})'.format(
+    trade="|".join(_HardcodeDictionary.TRADE),
+    food_names="|".join(_HardcodeDictionary.FOOD_NAMES)
+)
+FOOD_APPROVAL = "({})[^,().!]+?({})".format(
+    "|".join(_HardcodeDictionary.APPROVAL_WORDS), "|".join(_HardcodeDictionary.FOOD_NAMES)
+)
+RESTAURANT_APPROVAL = "({})[^,().!]+?({})".format(
+    "|".join(_HardcodeDictionary.APPROVAL_WORDS), "|".join(_HardcodeDictionary.RESTAURANT_NAMES)
+)
+
+_simple_negation = Regex(r"\bнет?\b")
+_nonverbal_approval = AllOf(Nonverbal(NONVERBAL_PHRASE_TAGS), Not(_simple_negation))
+
+
+def _parking_label(label, func):
+    return lambda match: func(match, label).capitalize()
+
+
+def _peak_is_landmark(words, pos_tags):
     """
+    Check whether a "ПИК" mall is mentioned in a text as a landmark (after a preposition) rather than as a subject.
 
-    dic = _HardcodeDictionary
-    compiled_parking_templates = (lambda: [(re.compile(r), l, f) for r, l, f in _PARKING_TEMPLATES])()
-    nonverbal_phrase_tags = {"A", "S", None, "PR", 'CONJ', "ADV"}
-
-    SENTENCE_START = r'(?:((?:{trade}) с |быть(?: бы)? )(?:\w+?[оыи]й )?)?(?:{food_names})'.format(
-        trade="|".join(_HardcodeDictionary.TRADE),
-        food_names="|".join(_HardcodeDictionary.FOOD_NAMES)
-    )
-    FOOD_APPROVAL = "({})[^,().!]+?({})".format("|".join(dic.APPROVAL_WORDS), "|".join(dic.FOOD_NAMES))
-
-    _sentence_start_re, _food_approval_re = re.compile(SENTENCE_START), re.compile(FOOD_APPROVAL)
-    _simple_negation_re = re.compile(r"\bнет?\b")
-
-    @classmethod
-    def is_nonverbal(cls, pos_tags):
-        return not (set(pos_tags) - cls.nonverbal_phrase_tags)
-
-    @classmethod
-    def _assign_headlines_parking(cls, lemmas, pos_tags, hl_set):
-        for regex, label, func in cls.compiled_parking_templates:
-            m = regex.search(lemmas)
-            if m:
-                hl_set.add(func(m, label))
-                break
-        else:
-            if cls.is_nonverbal(pos_tags) and not cls._simple_negation_re.search(lemmas):
-                if not "вело" in lemmas:
-                    hl_set.add("устроить парковку")
-
-    @classmethod
-    def _assign_headlines_food(cls, lemmas, pos_tags, additional_headlines):
-        approval_label = "Организовать продажу уличной еды"
-        for i in cls.dic.GOOD_FOOD_MARKERS:
-            if i in lemmas:
-                additional_headlines.add(approval_label)
-                return
-        if cls._food_approval_re.search(lemmas):
-            additional_headlines.add(approval_label)
-            return
-        if cls._sentence_start_re.match(lemmas):
-            additional_headlines.add(approval_label)
-            return
-        if cls.is_nonverbal(pos_tags) and not cls._simple_negation_re.search(lemmas):
-            additional_headlines.add(approval_label)
-
-    @classmethod
-    def _assign_headlines_restaurants(cls, lemmas, pos_tags, additional_headlines):
-        approval_label = TagNames.ALLOW_CAFE
-
-        regex = r"({})[^,().!]+?({})".format("|".join(cls.dic.APPROVAL_WORDS), "|".join(cls.dic.RESTAURANT_NAMES))
-        if re.search(regex, lemmas):
-            additional_headlines.add(approval_label)
-            return
-
-        if cls.is_nonverbal(pos_tags) and not cls._simple_negation_re.search(lemmas):
-            additional_headlines.add(approval_label)
-
-    @classmethod
-    def no_change_postproc(cls, answer, hls):
-        if TagNames.NO_CHANGE_REQUIRED in hls:
-            hls.clear()
-            hls.add(TagNames.NO_CHANGE_REQUIRED)
-
-    @classmethod
-    def trade_postproc(cls, answer, hls):
-        if TagNames.ALLOW_TRADE in hls or TagNames.FORBID_TRADE in hls:
-            hls.discard(TagNames.TRADE_GENERAL)
-        if TagNames.ALLOW_TRADE in hls and TagNames.FORBID_TRADE in hls:
-            hls.add(TagNames.TRADE_GENERAL)
-            hls.remove(TagNames.ALLOW_TRADE)
-            hls.remove(TagNames.FORBID_TRADE)
-
-    @classmethod
-    def parking_postproc(cls, answer, hls):
-        if TagNames.PARKING_GENERAL in hls:
-            additional_headlines = set()
-            cls._assign_headlines_parking(
-                answer.get_lemmas(False, True),
-                answer.pos_tags,
-                additional_headlines
-            )
-            if additional_headlines:
-                hls.remove(TagNames.PARKING_GENERAL)
-                hls.update({i.capitalize() for i in additional_headlines})
-
-    @classmethod
-    def street_food_postproc(cls, answer, hls):
-        if TagNames.STREET_FOOD_GENERAL in hls:
-            cls._assign_headlines_food(
-                answer.get_lemmas(False, True),
-                answer.pos_tags,
-                hls
-            )
-            if TagNames.ALLOW_STREET_FOOD in hls:
-                hls.remove(TagNames.STREET_FOOD_GENERAL)
-
-    @classmethod
-    def cafe_postproc(cls, answer: Answer, hls: set):
-        if TagNames.CAFE_GENERAL in hls:
-            cls._assign_headlines_restaurants(
-                answer.get_lemmas(False, True),
-                answer.pos_tags,
-                hls
-            )
-            if TagNames.ALLOW_CAFE in hls:
-                hls.discard(TagNames.CAFE_GENERAL)
-
-    @classmethod
-    def peak_postproc(cls, answer: Answer, hls: set):
-        """
-        Check whether a "ПИК" mall is mentioned in a text as a landmark or as a subject.
-
-        :param answer: An Answer object.
-        :param hls: A current set of headlines assigned to an answer.
-        """
-        words, pos_tags = answer.get_lemmas(False, False), answer.pos_tags
-        if TagNames.PEAK_GENERAL in hls:
-            try:
-                start_index = peak_index = words.index("пик")
-                while peak_index >= 0:
-                    if pos_tags[peak_index] not in ["PR", "A", "ADV", "S"]:
-                        if peak_index == start_index - 1 and pos_tags[peak_index] is None:
-                            peak_index -= 1
-                            continue  # ignoring quotes
-                        return
-                    if pos_tags[peak_index] == "PR":
-                        hls.discard(TagNames.PEAK_GENERAL)
-                        return
-                    peak_index -= 1
-            except ValueError:
-                pass
-
-
-POSTPROCESSING_SEQUENCE = [
-    Postprocs.no_change_postproc,
-    Postprocs.trade_postproc,
-    Postprocs.parking_postproc,
-    Postprocs.street_food_postproc,
-    Postprocs.cafe_postproc,
-    Postprocs.peak_postproc
-]
+    :param words: Lemmas of an answer.
+    :param pos_tags: Their parts of speech.
+    """
+    if "пик" not in words:
+        return False
+    start_index = peak_index = words.index("пик")
+    while peak_index >= 0:
+        if pos_tags[peak_index] not in ["PR", "A", "ADV", "S"]:
+            if peak_index == start_index - 1 and pos_tags[peak_index] is None:
+                peak_index -= 1
+                continue  # ignoring quotes
+            return False
+        if pos_tags[peak_index] == "PR":
+            return True
+        peak_index -= 1
+    return False
+
+
+RULES = RuleSet([
+    Rule(when=HasAny(TagNames.NO_CHANGE_REQUIRED), then=KeepOnly(TagNames.NO_CHANGE_REQUIRED)),
+
+    Rule(when=HasAny(TagNames.ALLOW_TRADE, TagNames.FORBID_TRADE), then=Discard(TagNames.TRADE_GENERAL)),
+    Rule(when=HasAll(TagNames.ALLOW_TRADE, TagNames.FORBID_TRADE), then=[
+        Add(TagNames.TRADE_GENERAL), Discard(TagNames.ALLOW_TRADE, TagNames.FORBID_TRADE)
+    ]),
+
+    FirstOf(*[
+        Rule(when=HasAny(TagNames.PARKING_GENERAL), pattern=Regex(regex),
+             then=Replace(TagNames.PARKING_GENERAL, _parking_label(label, func)))
+        for regex, label, func in _PARKING_TEMPLATES
+    ] + [
+        Rule(when=HasAny(TagNames.PARKING_GENERAL), pattern=AllOf(_nonverbal_approval, Not(Contains("вело"))),
+             then=Replace(TagNames.PARKING_GENERAL, "Устроить парковку")),
+    ]),
+
+    Rule(when=HasAny(TagNames.STREET_FOOD_GENERAL), pattern=AnyOf(
+        Regex("|".join(re.escape(i) for i in _HardcodeDictionary.GOOD_FOOD_MARKERS)),
+        Regex(FOOD_APPROVAL),
+        Regex(SENTENCE_START, anchored=True),
+        _nonverbal_approval,
+    ), then=Add(TagNames.ALLOW_STREET_FOOD)),
+    Rule(when=HasAll(TagNames.STREET_FOOD_GENERAL, TagNames.ALLOW_STREET_FOOD),
+         then=Discard(TagNames.STREET_FOOD_GENERAL)),
+
+    Rule(when=HasAny(TagNames.CAFE_GENERAL), pattern=AnyOf(Regex(RESTAURANT_APPROVAL), _nonverbal_approval),
+         then=Add(TagNames.ALLOW_CAFE)),
+    Rule(when=HasAll(TagNames.CAFE_GENERAL, TagNames.ALLOW_CAFE), then=Discard(TagNames.CAFE_GENERAL)),
+
+    Rule(when=HasAny(TagNames.PEAK_GENERAL), pattern=Check(_peak_is_landmark), then=Discard(TagNames.PEAK_GENERAL)),
+])
+
+POSTPROCESSING_SEQUENCE = [RULES.apply]
 
 
 QUESTIONED = {
@@ -0,0 +1,87 @@
+"""
+Splitting answers into sentences: NLTK's Punkt tokenizer splits a text into sentences, which are split by semicolons.
+
+Most answers are a short phrase without a single sentence end, so Punkt has nothing to decide in them:
+such texts are recognized without running it (see `SentenceSplitter.is_single_sentence`). Answers repeat a lot
+in survey tables, so results are also kept in a memo cache.
+"""
+
+import functools
+import re
+import threading
+
+from typing import Tuple
+
+import instrumentation
+import startup_profile
+
+# Characters Punkt considers as possible sentence ends (see nltk.tokenize.punkt.PunktLanguageVars).
+SENT_END_CHARS = (".", "?", "!")
+_SENT_END = re.compile("[" + re.escape("".join(SENT_END_CHARS)) + "]")
+
+
+class SentenceSplitter(object):
+    """
+    A function splitting a text into sentences.
+    """
+
+    def __init__(self, language: str = "english", fast_path: bool = True, cache_size: int = 20000):
+        """
+        :param language: A name of a Punkt model. It's the English one NLTK uses by default: the Russian model
+            has other abbreviations and sentence starters, so it splits some answers differently.
+        :param fast_path: If False, all the texts are split by Punkt.
+        :param cache_size: A number of texts whose sentences are kept (0 turns the cache off).
+        """
+        self.language = language
+        self.fast_path = fast_path
+        self._sent_tokenize = None
+        self._lock = threading.Lock()
+        self._split = functools.lru_cache(maxsize=cache_size)(self._split_uncached)
+
+    def load(self):
+        """
+        Load the Punkt model (it's loaded on the first split otherwise).
+        """
+        if self._sent_tokenize is None:
+            with self._lock:
+                if self._sent_tokenize is None:
+                    with startup_profile.timed("NLTK"):
+                        import nltk
+                    with startup_profile.timed("Punkt model"):
+                        # NLTK keeps the model loaded once it's used.
+                        nltk.sent_tokenize(".", self.language)
+                    self._sent_tokenize = functools.partial(nltk.sent_tokenize, language=self.language)
+
+    @staticmethod
+    def is_single_sentence(text: str) -> bool:
+        """
+        Check whether Punkt leaves a text as one sentence without running it.
+
+        Punkt only considers breaking a text after a sentence end character followed by punctuation or
+        by a space and another token, so a text without such characters but the last one is a sentence as it is.
+        """
+        stripped = text.rstrip()
+        return _SENT_END.search(stripped, 0, len(stripped) - 1) is None
+
+    def _split_uncached(self, text: str) -> Tuple[str, ...]:
+        if self.fast_path and self.is_single_sentence(text):
+            instrumentation.count("texts split without Punkt")
+            standard_sent = [text]
+        else:
+            self.load()
+            standard_sent = self._sent_tokenize(text)
+        return tuple(part for part in (i.strip() for sent in standard_sent for i in sent.split(";")) if part)
+
+    def __call__(self, text: str) -> Tuple[str, ...]:
+        """
+        Split a text into sentences.
+
+        :return: A tuple of non-empty stripped sentences.
+        """
+        return self._split(text)
+
+    def cache_info(self):
+        return self._split.cache_info()
+
+
+SPLITTER = SentenceSplitter()
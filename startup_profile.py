@@ -0,0 +1,82 @@
+"""
+Timing of imports and initialization of heavy resources (enchant dictionaries, NLTK models, Mystem processes).
+
+The module should be imported by a script before its other modules. If the script is run with `--profile-startup`,
+imports are timed from that moment on, and a report of time spent per component is printed to stderr at exit.
+"""
+
+import atexit
+import builtins
+import contextlib
+import sys
+import time
+
+from collections import OrderedDict
+
+FLAG = "--profile-startup"
+
+enabled = FLAG in sys.argv
+
+# Seconds spent per component: a top-level package imported or a resource initialized.
+_timings = OrderedDict()
+_started = time.perf_counter()
+
+
+def _add(component: str, seconds: float):
+    _timings[component] = _timings.get(component, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def timed(component: str):
+    """
+    Measure time spent on initialization of a component (does nothing unless profiling is enabled).
+
+    :param component: A name of a component to report the time under.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(component, time.perf_counter() - start)
+
+
+def _install_import_timer():
+    original_import = builtins.__import__
+    # Time spent on nested imports, to be subtracted from time of an outer one.
+    nested = [0.0]
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        outer_nested, nested[0] = nested[0], 0.0
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            _add("import " + name.partition(".")[0], elapsed - nested[0])
+            nested[0] = outer_nested + elapsed
+
+    builtins.__import__ = timed_import
+
+
+def report(file=sys.stderr, min_seconds=0.001):
+    """
+    Print time spent per component, from the most expensive one.
+
+    :param file: A file to print to.
+    :param min_seconds: Components which took less time are omitted.
+    """
+    print("Startup profile (seconds since the profiler was imported: {:.3f}):".format(
+        time.perf_counter() - _started), file=file)
+    for component, seconds in sorted(_timings.items(), key=lambda a: -a[1]):
+        if seconds >= min_seconds:
+            print("  {:<40} {:.3f}".format(component, seconds), file=file)
+
+
+if enabled:
+    _install_import_timer()
+    atexit.register(report)
@@ -2,26 +2,245 @@
 
 import csv
 import importlib
+import itertools
 import logging
+import multiprocessing
 import os
 import re
 import sys
 import time
-from collections import namedtuple, Counter
+from collections import deque, namedtuple, Counter
 
-from answer import Answer
-from readers import read_columns
+# Imported before the other modules of the package to time their imports (see --profile-startup).
+import startup_profile
+import analysis_cache
+import instrumentation
+import profiling
+from answer import Answer, iter_answers
+from columnar import is_columnar
+from matching import KeywordMatcher
+from readers import DuplicateFilter, iter_columns
+from rules import engine
+from rules.engine import RuleSet
+from tagging_state import (
+    POSTPROCESSING_BATCH_SIZE, analysis_digest, find_keywords, input_signature, module_digest, tag_with_state
+)
 
 logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s', level=logging.INFO, stream=sys.stderr)
 
 
-def iter_column(fn, col_number):
-    return (Answer(text) for _, text in read_columns(fn, col_number))
+def make_answers(pairs, batch_size=0):
+    """
+    Create answer instances.
+
+    :param pairs: Pairs (line number, answer text).
+    :param batch_size: A number of answers to analyze with one Mystem call (0 means analyzing them one by one).
+
+    :return: An iterator over answer instances.
+    """
+    if batch_size > 0:
+        return iter_answers(pairs, batch_size)
+    return (Answer(text, line) for line, text in pairs)
+
+
+def iter_column(fn, col_number, batch_size=0, duplicates=None):
+    """
+    Iterate over answers of a column.
+
+    :param fn: A path to a table file.
+    :param col_number: A number of a column to read.
+    :param batch_size: A number of answers to analyze with one Mystem call (0 means analyzing them one by one).
+    :param duplicates: A filter to skip repeated lines with (see readers.iter_columns).
+
+    :return: An iterator over answer instances.
+    """
+    return make_answers(iter_columns(fn, col_number, duplicates=duplicates), batch_size)
+
+
+def read_dictionary(fn):
+    """
+    Read a tagging dictionary (each line is a tag followed by its keywords).
+
+    :param fn: A path to a dictionary.
+
+    :return: A dict keyword -> tag and a matcher looking for the keywords.
+    """
+    matches = {}
+    with open(fn) as kwf:
+        reader = csv.reader(kwf, delimiter=",")
+        for line in reader:
+            hl, *kws = line
+            for kw in kws:
+                if kw:
+                    matches[kw] = hl
+    return matches, KeywordMatcher(matches)
+
+
+def find_tags(answer_instance, matches, matcher):
+    """
+    Assign tags to an answer by the keywords found in it.
+
+    :param answer_instance: An answer to tag.
+    :param matches: A dict keyword -> tag.
+    :param matcher: A matcher looking for the keywords.
+
+    :return: A set of tags.
+    """
+    return {matches[m] for m in find_keywords(answer_instance, matcher)}
+
+
+def tag_answers(answers, matches, matcher, rules):
+    """
+    Assign tags to answers and postprocess them in batches.
+
+    :param answers: An iterable of answers to tag.
+    :param matches: A dict keyword -> tag.
+    :param matcher: A matcher looking for the keywords.
+    :param rules: Postprocessing rules (see rules.engine.RuleSet.from_module).
+
+    :return: An iterator over pairs (answer source, a set of tags).
+    """
+    answers = iter(answers)
+    while True:
+        batch = list(itertools.islice(answers, POSTPROCESSING_BATCH_SIZE))
+        if not batch:
+            return
+        tag_sets = [find_tags(answer_instance, matches, matcher) for answer_instance in batch]
+        rules.apply_batch(batch, tag_sets)
+        yield from ((answer_instance.source, hls) for answer_instance, hls in zip(batch, tag_sets))
+
+
+# A state of a worker process: a dictionary, postprocessing rules and a batch size.
+_worker_state = {}
+
+WORKER_CHUNK_SIZE = 200
+# A number of chunks per worker submitted to a pool ahead of the one being consumed.
+WORKER_CHUNKS_IN_FLIGHT = 2
+
+
+def _init_worker(dic_path, postprocessing, batch_size, cache_path):
+    analysis_cache.configure(cache_path)
+    _worker_state["matches"], _worker_state["matcher"] = read_dictionary(dic_path)
+    _worker_state["rules"] = RuleSet.from_module(
+        importlib.import_module("rules." + postprocessing + ".postprocessings")
+    )
+    _worker_state["batch_size"] = batch_size
+
+
+def _tag_chunk(chunk):
+    return list(tag_answers(
+        make_answers(chunk, _worker_state["batch_size"]),
+        _worker_state["matches"],
+        _worker_state["matcher"],
+        _worker_state["rules"],
+    ))
+
+
+def tag_in_parallel(pairs, workers, dic_path, postprocessing, batch_size=0, cache_path=None):
+    """
+    Tag answers in several processes, each one running its own Mystem instance.
+
+    :param pairs: An iterable of pairs (line number, answer text).
+    :param workers: A number of worker processes.
+    :param dic_path: A path to a dictionary to use.
+    :param postprocessing: A name of a postprocessing module.
+    :param batch_size: A number of answers to analyze with one Mystem call.
+    :param cache_path: A path to a Mystem analysis cache.
+
+    :return: An iterator over pairs (answer source, a set of tags) in the order of the input.
+    """
+    chunk_size = max(batch_size, WORKER_CHUNK_SIZE)
+    pairs = iter(pairs)
+    chunks = iter(lambda: list(itertools.islice(pairs, chunk_size)), [])
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, _init_worker, (dic_path, postprocessing, batch_size, cache_path)) as pool:
+        # Pool.imap would read all the chunks at once: only a few chunks per worker are submitted in advance,
+        # and a new one is read as soon as the first pending one is consumed.
+        pending = deque(pool.apply_async(_tag_chunk, (chunk,))
+                        for chunk in itertools.islice(chunks, WORKER_CHUNKS_IN_FLIGHT * workers))
+        while pending:
+            tagged_chunk = pending.popleft().get()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(pool.apply_async(_tag_chunk, (chunk,)))
+            yield from tagged_chunk
 
 
 OutputFiles = namedtuple("OutputFiles", ["clear", "questioned", "trash"])
 
 
+def output_kind(tags, questioned):
+    """
+    Choose an output file for an answer.
+
+    :param tags: A set of tags assigned to an answer.
+    :param questioned: A set of tags requiring a manual check.
+
+    :return: A name of a field of OutputFiles.
+    """
+    if not tags or "?" in tags and len(tags) == 1:
+        return "trash"
+    elif tags & questioned:
+        return "questioned"
+    return "clear"
+
+
+def write_results(results, out_paths, delimiter, questioned, tag_number):
+    """
+    Write tagged answers to output files.
+
+    :param results: A list of pairs (answer source, a set of tags).
+    :param out_paths: OutputFiles with paths to write to.
+    :param delimiter: A delimiter to use in the output.
+    :param questioned: A set of tags requiring a manual check.
+    :param tag_number: A number of distinct tags (rows are padded to this number of tag columns).
+    """
+    with open(out_paths.clear, "w") as clear_file, open(out_paths.questioned, "w") as questioned_file, open(
+            out_paths.trash, "w") as trash_file:
+        writers = OutputFiles(*(
+            csv.writer(f, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
+            for f in (clear_file, questioned_file, trash_file)
+        ))
+        for num, (answer, tags) in enumerate(results):
+            line = [str(num + 2), answer] + sorted(tags) + [""] * (tag_number - len(tags))
+            getattr(writers, output_kind(tags, questioned)).writerow(line)
+
+
+def stream_results(tagged, out_paths, delimiter, questioned):
+    """
+    Write tagged answers to output files as soon as they're ready.
+
+    Since the number of tag columns is known only at the end, rows are written to temporary files first
+    and padded in a final pass, which reads the files line by line.
+
+    :param tagged: An iterable of pairs (answer source, a set of tags).
+    :param out_paths: OutputFiles with paths to write to.
+    :param delimiter: A delimiter to use in the output.
+    :param questioned: A set of tags requiring a manual check.
+
+    :return: A counter of tags.
+    """
+    all_tags = Counter()
+    part_paths = OutputFiles(*(path + ".part" for path in out_paths))
+    with open(part_paths.clear, "w") as clear_file, open(part_paths.questioned, "w") as questioned_file, open(
+            part_paths.trash, "w") as trash_file:
+        writers = OutputFiles(*(
+            csv.writer(f, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
+            for f in (clear_file, questioned_file, trash_file)
+        ))
+        for num, (answer, tags) in enumerate(tagged):
+            getattr(writers, output_kind(tags, questioned)).writerow([str(num + 2), answer] + sorted(tags))
+            all_tags.update(tags)
+
+    row_length = 2 + len(all_tags)
+    for part_path, path in zip(part_paths, out_paths):
+        with open(part_path, newline="") as src, open(path, "w") as dst:
+            writer = csv.writer(dst, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
+            for line in csv.reader(src, delimiter=delimiter):
+                writer.writerow(line + [""] * (row_length - len(line)))
+        os.remove(part_path)
+    return all_tags
+
+
 def generate_output_paths(directory=None):
     time_string = time.strftime("%Y_%m_%d_%H_%M")
     patterns = [
@@ -42,100 +261,141 @@ def discover_rules(path):
             yield ".".join(root[len(absroot)+1+len(path)+1:].split("/"))
 
 
+def rules_exist(path, name):
+    """
+    Check whether a postprocessing module exists without walking the whole rule tree.
+
+    :param path: A directory containing rules (relative to the script).
+    :param name: A name of a module as `discover_rules` yields it.
+    """
+    if not re.fullmatch(r"\w+(?:\.\w+)*", name):
+        return False
+    absroot = os.path.dirname(os.path.realpath(__file__))
+    return os.path.isfile(os.path.join(absroot, path, *name.split("."), "postprocessings.py"))
+
+
 def parse_args(rule_discovery_path):
-    rules = discover_rules(rule_discovery_path)
     import argparse
     parser = argparse.ArgumentParser(description="A script classifying respondents' answers using a dictionary.")
-    parser.add_argument("csv", type=str, metavar="PATH", help="a path to a file to process")
+    parser.add_argument("csv", type=str, metavar="PATH",
+                        help="a path to a file (or a columnar table directory, see columnar.py) to process")
     parser.add_argument("column", type=int, metavar="NUM", help="a number of a column to get answers from")
     parser.add_argument("dic", type=str, metavar="PATH", help="a path to a dictionary to use")
     parser.add_argument("-d", "--delimiter", type=str, default="\t", metavar="SYMBOL",
                         help="a symbol to use as a delimiter in the output")
     parser.add_argument("-p", "--postprocessing",
                         type=str,
-                        choices=list(rules),
                         default="default", metavar="MODULE_PATH",
-                        help="a name of a module to use as postprocessing")
+                        help="a name of a module to use as postprocessing (e.g. 'sennaya' or 'alexandrovsky.wishes')")
 
     parser.add_argument(
         "-o", "--output", type=str, metavar="PATH",
         help="a path to a directory to put the results to (by default they're saved to a dir where the script's located)"
     )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=0, metavar="NUM",
+        help="a number of answers to send to Mystem at once, one per line (by default answers are analyzed "
+             "one by one); the analyses are the same"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, metavar="NUM",
+        help="a number of processes to tag answers in (it can't be used with --state)"
+    )
+    parser.add_argument(
+        "--cache", type=str, metavar="PATH",
+        help="a path to a file to cache Mystem analyses in (see analysis_cache.py)"
+    )
+    parser.add_argument(
+        "-s", "--stream", action="store_true",
+        help="write each answer to an output file as soon as it's tagged instead of keeping all of them in memory"
+    )
+    parser.add_argument(
+        "--duplicates", type=str, choices=DuplicateFilter.MODES, default="memory",
+        help="how to keep track of lines seen to skip duplicates ('disk' and 'bloom' are for very large tables)"
+    )
+    parser.add_argument(
+        "--key-columns", type=int, nargs="+", metavar="NUM",
+        help="numbers of columns to compare lines by when looking for duplicates (all but the first by default)"
+    )
+    parser.add_argument(
+        "--state", type=str, metavar="PATH",
+        help="a path to a file keeping analyzed answers and keyword matches between runs: if the table and the column "
+             "are the same as in the previous run, only changes of the dictionary and postprocessing are applied"
+    )
+    parser.add_argument(
+        startup_profile.FLAG, action="store_true",
+        help="print time spent on imports and initialization of heavy resources at exit"
+    )
+    instrumentation.add_arguments(parser)
+    profiling.add_arguments(parser)
     parsed = parser.parse_args()
+    if parsed.state is not None and parsed.workers > 1:
+        parser.error("argument -w/--workers: answers are tagged in one process with --state")
+    if not rules_exist(rule_discovery_path, parsed.postprocessing):
+        parser.error("argument -p/--postprocessing: invalid choice: '{}' (choose from {})".format(
+            parsed.postprocessing, ", ".join("'{}'".format(i) for i in sorted(discover_rules(rule_discovery_path)))
+        ))
     parsed.csv = os.path.expanduser(os.path.abspath(parsed.csv))
     parsed.dic = os.path.expanduser(os.path.abspath(parsed.dic))
     if parsed.output is not None:
         parsed.output = os.path.expanduser(os.path.abspath(parsed.output))
+    if parsed.cache is not None:
+        parsed.cache = os.path.expanduser(os.path.abspath(parsed.cache))
+    if parsed.state is not None:
+        parsed.state = os.path.expanduser(os.path.abspath(parsed.state))
 
     assert parsed.column >= 0
-    assert os.path.isfile(parsed.csv)
+    assert os.path.isfile(parsed.csv) or is_columnar(parsed.csv)
     assert os.path.isfile(parsed.dic)
     assert parsed.output is None or os.path.isdir(parsed.output)
     assert len(parsed.delimiter) == 1
+    assert parsed.batch_size >= 0
+    assert parsed.workers >= 1
     return parsed
 
 
 if __name__ == "__main__":
     args = parse_args("rules")
+    analysis_cache.configure(args.cache)
+    instrumentation.configure(args)
+    profiling.configure(args)
 
-    postprocessings = importlib.import_module("rules." + args.postprocessing + ".postprocessings")
-
-    matches = {}
-    regexes = {}
-    with open(args.dic) as kwf:
-        reader = csv.reader(kwf, delimiter=",")
-        for line in reader:
-            hl, *kws = line
-            for kw in kws:
-                if kw:
-                    matches[kw] = hl
-                    regexes[kw] = re.compile(r'\b{}\b'.format(kw), flags=re.I)
+    with startup_profile.timed("postprocessing rules"):
+        postprocessings = importlib.import_module("rules." + args.postprocessing + ".postprocessings")
 
     results, all_tags = [], []
 
-    for answer_instance in iter_column(args.csv, args.column):
-        lemmas_text = answer_instance.get_lemmas(skip_punct=False, as_string=True).lower()
-        hls = set()
-        for m in matches:
-            if regexes[m].search(lemmas_text):
-                logging.info("Found: '%s' in <<%s>>", m, lemmas_text)
-                hls.add(matches[m])
-        if not hls:
-            logging.info("Unprocessed: %s", lemmas_text)
+    def read_answers():
+        return iter_column(args.csv, args.column, args.batch_size, DuplicateFilter(args.key_columns, args.duplicates))
 
-        for postproc in postprocessings.POSTPROCESSING_SEQUENCE:
-            postproc(answer_instance, hls)
+    if args.state is not None:
+        matches, matcher = read_dictionary(args.dic)
+        tagged = tag_with_state(
+            args.state, input_signature(args.csv, args.column, args.key_columns, args.duplicates),
+            analysis_digest(), read_answers, matches, matcher, RuleSet.from_module(postprocessings),
+            module_digest(postprocessings, engine)
+        )
+    elif args.workers > 1:
+        tagged = tag_in_parallel(
+            iter_columns(args.csv, args.column, duplicates=DuplicateFilter(args.key_columns, args.duplicates)),
+            args.workers, args.dic, args.postprocessing, args.batch_size, args.cache
+        )
+    else:
+        matches, matcher = read_dictionary(args.dic)
+        tagged = tag_answers(read_answers(), matches, matcher, RuleSet.from_module(postprocessings))
 
-        results.append((answer_instance.source, hls))
-        all_tags.extend(hls)
+    out_paths = generate_output_paths(args.output)
 
-    all_tags = Counter(all_tags)
+    if args.stream:
+        all_tags = stream_results(tagged, out_paths, args.delimiter, postprocessings.QUESTIONED)
+    else:
+        for source, hls in tagged:
+            results.append((source, hls))
+            all_tags.extend(hls)
+        all_tags = Counter(all_tags)
 
     for i in sorted(all_tags.keys()):
         print(i, all_tags[i], file=sys.stderr)
 
-    header_tagging = sorted(all_tags.keys())
-    header = ["ID", "Исходный текст"] + header_tagging
-
-    out_paths = generate_output_paths(args.output)
-
-    with open(out_paths.clear, "w") as clear_file, open(out_paths.questioned, "w") as questioned_file, open(
-            out_paths.trash, "w") as trash_file:
-        c_writer = csv.writer(clear_file, delimiter=args.delimiter, quoting=csv.QUOTE_MINIMAL)
-        q_writer = csv.writer(questioned_file, delimiter=args.delimiter, quoting=csv.QUOTE_MINIMAL)
-        t_writer = csv.writer(trash_file, delimiter=args.delimiter, quoting=csv.QUOTE_MINIMAL)
-
-        # c_writer.writerow(header)
-        # q_writer.writerow(header)
-        # t_writer.writerow(header)
-
-        for num, (answer, tags) in enumerate(results):
-            if not tags or "?" in tags and len(tags) == 1:
-                active_writer = t_writer
-            elif tags & postprocessings.QUESTIONED:
-                active_writer = q_writer
-            else:
-                active_writer = c_writer
-            line = [str(num + 2), answer] + sorted(tags) + [""] * (
-                len(header_tagging) - len(tags))  # ["" if i not in tags else i for i in header_tagging]
-            active_writer.writerow(line)
+    if not args.stream:
+        write_results(results, out_paths, args.delimiter, postprocessings.QUESTIONED, len(all_tags))
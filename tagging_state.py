@@ -0,0 +1,281 @@
+"""
+A state of a tagging run kept to re-apply a changed dictionary quickly.
+
+The state keeps analyzed answers, keywords found in each of them and their final tags.
+When only the dictionary or the postprocessing rules change, keywords added to the dictionary are looked for
+only in answers containing all their words, and only answers whose keywords changed are postprocessed again.
+If the code analyzing answers and looking for keywords or Mystem change (see analysis_digest),
+the state isn't reused.
+"""
+
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import sys
+
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+
+import answer
+import generalling
+import instrumentation
+import matching
+import mystem_pool
+from columnar import MANIFEST, is_columnar
+from matching import KeywordMatcher, keyword_words, text_words
+
+STATE_VERSION = 2
+
+POSTPROCESSING_BATCH_SIZE = 200
+
+
+def lemmas_text(answer_instance) -> str:
+    """
+    Get a text keywords are looked for in.
+    """
+    return answer_instance.get_lemmas(skip_punct=False, as_string=True).lower()
+
+
+def find_keywords(answer_instance, matcher: KeywordMatcher) -> List[str]:
+    """
+    Find dictionary keywords in an answer.
+
+    :param answer_instance: An answer.
+    :param matcher: A matcher looking for the keywords.
+
+    :return: A list of keywords found.
+    """
+    text = lemmas_text(answer_instance)
+    with instrumentation.answer(answer_instance.source), instrumentation.timed("keyword search"):
+        found = matcher.search(text)
+    for m in found:
+        logging.info("Found: '%s' in <<%s>>", m, text)
+    if not found:
+        logging.info("Unprocessed: %s", text)
+    return found
+
+
+def input_signature(path: str, column: int, key_columns: Union[List[int], None], duplicates_mode: str) -> tuple:
+    """
+    Identify answers read from a table: a state can be reused only if the signature is the same.
+
+    :param path: A path to a table or a columnar table directory.
+    :param column: A number of a column answers are read from.
+    :param key_columns: Numbers of columns duplicate lines are detected by.
+    :param duplicates_mode: A mode of duplicate detection.
+    """
+    stat = os.stat(os.path.join(path, MANIFEST) if is_columnar(path) else path)
+    return path, stat.st_size, stat.st_mtime_ns, column, tuple(key_columns or ()), duplicates_mode
+
+
+def module_digest(*modules) -> str:
+    """
+    Calculate a digest of sources of modules (e.g. of postprocessing rules and the engine applying them).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for module in modules:
+        with open(inspect.getsourcefile(module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def analysis_digest() -> str:
+    """
+    Identify the way answers of a state are analyzed and searched for keywords: the code doing it
+    and the Mystem version.
+    """
+    return "{} {}".format(
+        module_digest(answer, generalling, matching, mystem_pool, sys.modules[__name__]),
+        generalling.GLOBAL_MYSTEM.version
+    )
+
+
+class TaggingState(object):
+    """
+    Answers of a tagging run together with keywords found in them and their tags.
+    """
+
+    def __init__(self, signature: tuple, analysis: str, answers: list, keywords: List[Set[str]],
+                 index: Dict[str, Set[int]], matches: Dict[str, str], rules_digest: str, tags: List[Set[str]],
+                 postings: Dict[str, List[int]]):
+        """
+        :param signature: A signature of the input (see input_signature).
+        :param analysis: A digest of the way the answers are analyzed (see analysis_digest).
+        :param answers: Answer instances.
+        :param keywords: Sets of keywords found in each answer.
+        :param index: Numbers of answers each keyword is found in.
+        :param matches: A dictionary (keyword -> tag) the keywords are taken from.
+        :param rules_digest: A digest of postprocessing rules applied.
+        :param tags: Final sets of tags of each answer.
+        :param postings: Numbers of answers containing each word.
+        """
+        self.signature = signature
+        self.analysis = analysis
+        self.answers = answers
+        self.keywords = keywords
+        self.index = index
+        self.matches = matches
+        self.rules_digest = rules_digest
+        self.tags = tags
+        self.postings = postings
+
+    def _add_match(self, num: int, keyword: str):
+        self.keywords[num].add(keyword)
+        self.index.setdefault(keyword, set()).add(num)
+
+    @classmethod
+    def build(cls, signature: tuple, analysis: str, answers: Iterable, matches: Dict[str, str],
+              matcher: KeywordMatcher, rules, rules_digest: str) -> "TaggingState":
+        """
+        Tag answers from scratch.
+
+        :param signature: A signature of the input (see input_signature).
+        :param analysis: A digest of the way the answers are analyzed (see analysis_digest).
+        :param answers: An iterable of answer instances.
+        :param matches: A dictionary (keyword -> tag).
+        :param matcher: A matcher looking for the keywords.
+        :param rules: Postprocessing rules (see rules.engine.RuleSet).
+        :param rules_digest: A digest of the rules.
+        """
+        state = cls(signature, analysis, [], [], {}, dict(matches), rules_digest, [], {})
+        for num, answer_instance in enumerate(answers):
+            state.answers.append(answer_instance)
+            state.keywords.append(set())
+            state.tags.append(set())
+            for keyword in find_keywords(answer_instance, matcher):
+                state._add_match(num, keyword)
+            for word in set(text_words(lemmas_text(answer_instance))):
+                state.postings.setdefault(word, []).append(num)
+        state._postprocess(range(len(state.answers)), rules)
+        return state
+
+    @classmethod
+    def load(cls, path: str) -> Union["TaggingState", None]:
+        """
+        Load a state saved by a previous run.
+
+        :return: A state or None if there's no state of a supported version.
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            # Objects of the state were pickled by another version of the code (or the file is damaged).
+            logging.warning("The state can't be loaded, it's built again", exc_info=True)
+            return None
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return None
+        del data["version"]
+        return cls(**data)
+
+    def save(self, path: str):
+        data = dict(vars(self), version=STATE_VERSION)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def _postprocess(self, numbers: Iterable[int], rules):
+        numbers = list(numbers)
+        for start in range(0, len(numbers), POSTPROCESSING_BATCH_SIZE):
+            batch = numbers[start:start + POSTPROCESSING_BATCH_SIZE]
+            tag_sets = [{self.matches[kw] for kw in self.keywords[num]} for num in batch]
+            rules.apply_batch([self.answers[num] for num in batch], tag_sets)
+            for num, tags in zip(batch, tag_sets):
+                self.tags[num] = tags
+
+    def _candidates(self, keyword: str) -> Iterable[int]:
+        """
+        Get numbers of answers which may contain a keyword.
+        """
+        words = keyword_words(keyword)
+        if words is None:
+            return range(len(self.answers))
+        postings = [self.postings.get(word, ()) for word in set(words)]
+        if not postings:
+            return range(len(self.answers))
+        candidates = set(min(postings, key=len))
+        for numbers in postings:
+            candidates.intersection_update(numbers)
+        return candidates
+
+    def update(self, matches: Dict[str, str], rules, rules_digest: str) -> int:
+        """
+        Apply a new dictionary and new postprocessing rules.
+
+        :param matches: A new dictionary (keyword -> tag).
+        :param rules: Postprocessing rules (see rules.engine.RuleSet).
+        :param rules_digest: A digest of the rules.
+
+        :return: A number of answers postprocessed again.
+        """
+        old = self.matches
+        added = [kw for kw in matches if kw not in old]
+        removed = {kw for kw in old if kw not in matches}
+        retagged = {kw for kw in matches if kw in old and matches[kw] != old[kw]}
+
+        affected = set()
+        for kw in retagged:
+            affected.update(self.index.get(kw, ()))
+        for kw in removed:
+            for num in self.index.pop(kw, ()):
+                self.keywords[num].discard(kw)
+                affected.add(num)
+        if added:
+            matcher = KeywordMatcher(added)
+            candidates = set()
+            for kw in added:
+                candidates.update(self._candidates(kw))
+            for num in sorted(candidates):
+                for kw in matcher.search(lemmas_text(self.answers[num])):
+                    self._add_match(num, kw)
+                    affected.add(num)
+        logging.info("Dictionary changes: %d keywords added, %d removed, %d moved to other tags",
+                     len(added), len(removed), len(retagged))
+
+        self.matches = dict(matches)
+        if rules_digest != self.rules_digest:
+            logging.info("Postprocessing rules changed: all the answers are postprocessed again")
+            affected = range(len(self.answers))
+            self.rules_digest = rules_digest
+        self._postprocess(sorted(affected), rules)
+        return len(affected)
+
+    def results(self) -> List[Tuple[str, Set[str]]]:
+        """
+        :return: A list of pairs (answer source, a set of tags) in the order of the input.
+        """
+        return [(answer_instance.source, tags) for answer_instance, tags in zip(self.answers, self.tags)]
+
+
+def tag_with_state(path: str, signature: tuple, analysis: str, make_answers: Callable[[], Iterable],
+                   matches: Dict[str, str], matcher: KeywordMatcher, rules,
+                   rules_digest: str) -> List[Tuple[str, Set[str]]]:
+    """
+    Tag answers reusing a state of a previous run if it was run on the same input analyzed the same way.
+
+    :param path: A path to a state file (it's created or updated).
+    :param signature: A signature of the input (see input_signature).
+    :param analysis: A digest of the way answers are analyzed (see analysis_digest).
+    :param make_answers: A function returning answer instances; it's called only if the state can't be reused.
+    :param matches: A dictionary (keyword -> tag).
+    :param matcher: A matcher looking for the keywords.
+    :param rules: Postprocessing rules (see rules.engine.RuleSet).
+    :param rules_digest: A digest of the rules.
+
+    :return: A list of pairs (answer source, a set of tags) in the order of the input.
+    """
+    state = TaggingState.load(path)
+    if state is not None and state.signature == signature and state.analysis == analysis:
+        affected = state.update(matches, rules, rules_digest)
+        logging.info("Incremental tagging: %d answers of %d postprocessed again", affected, len(state.answers))
+    else:
+        if state is not None and state.signature != signature:
+            logging.info("The input changed since the state was saved: tagging from scratch")
+        elif state is not None:
+            logging.info("Answers are analyzed by another version of the code or Mystem: tagging from scratch")
+        state = TaggingState.build(signature, analysis, make_answers(), matches, matcher, rules, rules_digest)
+    state.save(path)
+    return state.results()